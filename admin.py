@@ -22,6 +22,9 @@ from google.appengine.ext import ndb, deferred
 
 import netskrafl
 from languages import Alphabet
+from dawgdictionary import Wordbase, PackedNavigation
+from skraflmechanics import CrossCheckCache
+from skraflplayer import LeftPartCache
 from skrafldb import Context, UserModel, GameModel
 from skraflgame import User, Game
 
@@ -37,6 +40,29 @@ def admin_usercount():
     return jsonify(count = count)
 
 
+@app.route("/admin/cachestats", methods=['GET', 'POST'])
+def admin_cachestats():
+    """ Return statistics for the in-process caches of this instance """
+    return jsonify(
+        edges = PackedNavigation.cache_stats(),
+        crosschecks = CrossCheckCache.stats(),
+        leftparts = LeftPartCache.stats(),
+        warmup = Wordbase.warmup_status()
+    )
+
+
+@app.route("/admin/reload", methods=['POST'])
+def admin_reload():
+    """ Swap freshly built dictionaries into this instance, without a restart.
+        By default, all loaded dictionaries are reloaded from their files. """
+    names = request.form.getlist("name")
+    unknown = [name for name in names if name not in Wordbase.names()]
+    if unknown:
+        return jsonify(ok = False, unknown = unknown)
+    Wordbase.reload(*names)
+    return jsonify(ok = True)
+
+
 def deferred_update():
     """ Update all users in the datastore with lowercase nick and full name """
     logging.info("Deferred user update starting")
@@ -106,7 +106,7 @@ import binascii
 import struct
 import io
 
-from dawgdictionary import PackedDawgDictionary
+from dawgdictionary import PackedDawgDictionary, BloomFilter, DawgHeader, GADDAG_SEPARATOR
 
 # The DAWG builder uses the collation (sorting) given by Alphabet.sortkey
 # This is by default the Icelandic sorting order
@@ -435,9 +435,16 @@ class _BinaryDawgPacker:
                                     coded as an index into AÁBDÐEÉFGHIÍJKLMNOÓPRSTUÚVXYÝÞÆÖ
                 DWORD Offset of child node
 
+        In a GADDAG, the separator character '+' is coded as the
+        index following the last letter of the alphabet and the blank
+        tile '?', which never occurs in the graph.
+
+        In the output file, the stream is preceded by a header that
+        describes it. See DawgHeader in dawgdictionary.py.
+
     """
 
-    ENCODING = Alphabet.order
+    ENCODING = Alphabet.all_tiles + GADDAG_SEPARATOR
     BYTE = struct.Struct("<B")
     UINT32 = struct.Struct("<L")
 
@@ -449,11 +456,15 @@ class _BinaryDawgPacker:
         # node id has been referenced without knowing where the node is
         # located
         self._fixups = dict()
+        # Counts of nodes (including the root) and edges written
+        self.num_nodes = 0
+        self.num_edges = 0
 
     def start(self, num_root_edges):
         # The stream starts off with a single byte containing the
         # number of root edges
         self._stream.write(self.BYTE.pack(num_root_edges))
+        self.num_nodes += 1
 
     def node_start(self, ident, final, num_edges):
         stream = self._stream
@@ -469,6 +480,7 @@ class _BinaryDawgPacker:
         # Remember where we put this node
         self._locs[ident] = pos
         stream.write(self.BYTE.pack((0x80 if final else 0x00) | (num_edges & 0x7F)))
+        self.num_nodes += 1
 
     def node_end(self, ident):
         pass
@@ -476,6 +488,7 @@ class _BinaryDawgPacker:
     def edge(self, ident, prefix):
         b = bytearray()
         stream = self._stream
+        self.num_edges += 1
         for c in prefix:
             if c == u'|':
                 b[-1] |= 0x80
@@ -541,6 +554,11 @@ class DawgBuilder:
 
     def __init__(self):
         self._dawg = None
+        # List of words added to the graph, if a lookup filter
+        # or a GADDAG is to be built
+        self._words = None
+        # Number of words added to the graph
+        self._num_words = 0
 
     class _InFile(object):
         """ InFile represents a single sorted input file. """
@@ -729,6 +747,8 @@ class DawgBuilder:
                 else:
                     # Not a word to be removed: add it to the graph
                     self._dawg.add_word(word)
+                    if self._words is not None:
+                        self._words.append(word)
                     outcount += 1
                 lastword = word
                 lastkey = key
@@ -746,19 +766,79 @@ class DawgBuilder:
         self._dawg.finish()
         print("Finished loading {0} words, output {1} words, {2} duplicates skipped, {3} removed"
             .format(incount, outcount, duplicates, removed))
+        self._num_words = outcount
 
-    def _output_binary(self, relpath, output):
-        """ Write the DAWG to a flattened binary output file with extension '.dawg' """
-        assert self._dawg is not None
+    @staticmethod
+    def _write_atomic(fname, data):
+        """ Write data to a binary file by replacing it with a complete new file,
+            so that running processes that have memory-mapped the old file, or
+            are about to reload it, never see a partially written one """
+        tmpname = fname + u".tmp"
+        with open(tmpname, "wb") as of:
+            of.write(data)
+        if os.name == "nt" and os.path.exists(fname):
+            # Windows does not allow renaming onto an existing file
+            os.remove(fname)
+        os.rename(tmpname, fname)
+
+    @staticmethod
+    def _pack(dawg, num_words, sections = None):
+        """ Flatten a DAWG and return the contents of a packed binary file for it """
         f = io.BytesIO()
         # Create a packer to flatten the tree onto a binary stream
         p = _BinaryDawgPacker(f)
         # Write the tree using the packer
-        self._dawg.write_packed(p)
-        # Write packed DAWG to binary file
-        with open(os.path.abspath(os.path.join(relpath, output + u".bin.dawg")), "wb") as of:
-            of.write(f.getvalue())
+        dawg.write_packed(p)
+        packed = DawgHeader.pack_file(_BinaryDawgPacker.ENCODING, f.getvalue(),
+            p.num_nodes, p.num_edges, num_words, sections)
         f.close()
+        return packed
+
+    def _output_binary(self, relpath, output, lookup_filter):
+        """ Write the DAWG to a flattened binary output file with extension '.bin.dawg'.
+            If lookup_filter is True, a negative lookup filter for the words in the
+            DAWG is included in the file. """
+        assert self._dawg is not None
+        sections = []
+        if lookup_filter:
+            print("Outputting lookup filter...")
+            assert self._words is not None
+            bf = BloomFilter.for_capacity(len(self._words))
+            for word in self._words:
+                bf.add(word)
+            sections.append((DawgHeader.FILTER, bf.to_bytes()))
+        packed = self._pack(self._dawg, self._num_words, sections)
+        self._write_atomic(os.path.abspath(os.path.join(relpath, output + u".bin.dawg")), packed)
+
+    def _output_gaddag(self, relpath, output):
+        """ Write a GADDAG for the words in the DAWG to a flattened binary output
+            file with extension '.bin.gaddag'. The GADDAG contains the string
+            REV(x) + '+' + y for every split of each word into a nonempty
+            prefix x and a possibly empty suffix y. """
+        assert self._words is not None
+        gaddag = _Dawg()
+        sep = GADDAG_SEPARATOR
+        count = 0
+        # The strings must be added in sorted order. To limit memory usage,
+        # generate and sort them in groups by their first letter, i.e. the
+        # last letter of the prefix.
+        for letter in Alphabet.order:
+            strings = []
+            for word in self._words:
+                i = word.find(letter)
+                while i >= 0:
+                    strings.append(word[i::-1] + sep + word[i + 1:])
+                    i = word.find(letter, i + 1)
+            strings.sort(key = Alphabet.sortkey)
+            for s in strings:
+                gaddag.add_word(s)
+            count += len(strings)
+            print("{0}...".format(count), end="\r")
+            sys.stdout.flush()
+        gaddag.finish()
+        print("GADDAG contains {0} strings in {1} nodes".format(count, gaddag.num_unique_nodes()))
+        self._write_atomic(os.path.abspath(os.path.join(relpath, output + u".bin.gaddag")),
+            self._pack(gaddag, count))
 
     def _output_text(self, relpath, output):
         """ Write the DAWG to a text output file with extension '.text.dawg' """
@@ -767,10 +847,14 @@ class DawgBuilder:
         with codecs.open(fname, mode='w', encoding='utf-8') as fout:
             self._dawg.write_text(fout)
 
-    def build(self, inputs, output, relpath="resources", word_filter=None, removals=None):
+    def build(self, inputs, output, relpath="resources", word_filter=None, removals=None,
+        lookup_filter=False, gaddag=False):
         """ Build a DAWG from input file(s) and write it to the output file(s) (potentially in multiple formats).
             The input files are assumed to be individually sorted in correct ascending alphabetical
             order. They will be merged in parallel into a single sorted stream and added to the DAWG.
+            If lookup_filter is True, a filter for fast rejection of unknown words is included
+            in the binary DAWG. If gaddag is True, a GADDAG of the same words is
+            also written, for use in move generation.
         """
         # inputs is a list of input file names
         # output is an output file name without file type suffix (extension);
@@ -781,12 +865,17 @@ class DawgBuilder:
             # Nothing to do
             print("No inputs or no output: Nothing to do")
             return
+        self._words = [] if (lookup_filter or gaddag) else None
         self._load(relpath, inputs, removals, word_filter)
         # print("Dumping...")
         # self._dawg.dump()
         print("Outputting...")
         #self._output_text(relpath, output)
-        self._output_binary(relpath, output)
+        self._output_binary(relpath, output, lookup_filter)
+        if gaddag:
+            print("Outputting GADDAG...")
+            self._output_gaddag(relpath, output)
+        self._words = None
         print("DawgBuilder done")
 
 
@@ -848,8 +937,9 @@ def run_twl06():
     print("Build took {0:.2f} seconds".format(t1 - t0))
 
 
-def run_skrafl():
-    """ Build a DAWG from the files listed """
+def run_skrafl(gaddag = False):
+    """ Build a DAWG from the files listed, and optionally a GADDAG
+        of the same words for GADDAG-based move generation """
     # This creates a DAWG from the full database of Icelandic words in
     # 'Beygingarlýsing íslensks nútímamáls' (BIN), except abbreviations,
     # 'skammstafanir', and proper names, 'sérnöfn'.
@@ -864,7 +954,9 @@ def run_skrafl():
         "ordalisti", # Output file - full name will be ordalisti.text.dawg
         "resources", # Subfolder of input and output files
         filter_skrafl, # Word filter function to apply
-        "ordalisti.remove.txt" # Words to remove
+        "ordalisti.remove.txt", # Words to remove
+        lookup_filter = True, # Include a filter for fast rejection of unknown words
+        gaddag = gaddag # Write ordalisti.bin.gaddag if requested
     )
     t1 = time.time()
     print("Build took {0:.2f} seconds".format(t1 - t0))
@@ -878,6 +970,11 @@ def run_skrafl():
 
     print("DAWG packed binary file loaded in {0:.2f} seconds".format(t1 - t0))
 
+    if not dawg.verify():
+        print("Warning: DAWG packed binary file does not match its checksum")
+    if not dawg.has_filter():
+        print("Warning: lookup filter for DAWG could not be loaded")
+
     # Process list of common words
 
     print(u"Starting DAWG build for list of common words")
@@ -907,6 +1004,8 @@ def run_skrafl():
 
 if __name__ == '__main__':
 
-    # Build the whole Icelandic Netskrafl word database by default
-    run_skrafl()
+    # Build the whole Icelandic Netskrafl word database by default.
+    # The GADDAG is only built if requested with -g, since no robot level
+    # generates moves from it by default (see AutoPlayer.GADDAG_LEVELS).
+    run_skrafl(gaddag = "-g" in sys.argv[1:])
 
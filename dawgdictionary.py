@@ -11,17 +11,32 @@
     The graph is pre-built using the code in dawgbuilder.py and stored
     in a text-based file to be loaded at run-time by DawgDictionary.
 
-    The main class supports three fundamental query functions:
+    The main class supports the following query functions:
 
     DawgDictionary.find(word)
         Returns True if the word is found in the dictionary, or False if not.
         The __contains__ operator is supported, so "'myword' in dawgdict" also works.
 
+    DawgDictionary.find_many(words)
+        Returns a list of booleans, one for each word in the words list, indicating
+        whether the word is found in the dictionary. Words sharing a common prefix
+        share the traversal of that prefix, so this is faster than repeated find() calls.
+
     DawgDictionary.find_matches(pattern)
         Returns a list of words that match the pattern. The pattern can contain
         wildcards ('?'). For example, result = dawgdict.find_matches("ex???") returns
         a list of all 5-letter words starting with "ex".
 
+    PackedDawgDictionary.navigate_gaddag(constraints)
+        Generates words through an anchor square from a GADDAG, i.e. a graph of
+        all words in the form REV(x) + '+' + y for every split of a word into a
+        nonempty x and a possibly empty y. See GaddagConstraints.
+
+    DawgDictionary.crosscheck_bits(above, below)
+        Returns a bit pattern (see Alphabet.letter_bit) of all letters that form
+        a valid word when placed between the above and below strings. This is
+        equivalent to, but much faster than, find_matches(above + "?" + below).
+
     DawgDictionary.find_permutations(rack)
         Returns a list of all permutations of the given rack, i.e. valid words
         consisting of one or more letters from the rack in various orders.
@@ -55,14 +70,35 @@ import os
 import codecs
 import threading
 import logging
+from collections import deque
 import time
 import struct
+import hashlib
+import zlib
+from array import array
+from itertools import izip
 # noinspection PyPep8Naming
 import cPickle as pickle
 
+try:
+    # Memory mapping of the packed DAWG is optional; it is not
+    # available in restricted environments such as the App Engine sandbox
+    import mmap
+    import ctypes
+except ImportError:
+    mmap = None
+    ctypes = None
+
 from languages import Alphabet
 
 
+# The separator between the reversed left part and the right part of words
+# in a GADDAG. Its code in the packed format follows the codes of the tiles,
+# so that it is distinct from the code of the blank tile (Alphabet.BLANK).
+GADDAG_SEPARATOR = u'+'
+GADDAG_SEPARATOR_CODE = len(Alphabet.all_tiles)
+
+
 class _Node:
 
     """ This class must be at module level for pickling """
@@ -171,6 +207,23 @@ class DawgDictionary:
         """ Enable simple lookup syntax: "word" in dawgdict """
         return self.find(word)
 
+    def find_many(self, words):
+        """ Look for a batch of words in the graph, returning a list
+            of booleans indicating whether each word is found """
+        if self._nodes is None:
+            return [False] * len(words)
+        return _find_many(words, self._nodes[0], lambda node, depth: node.edges.iteritems(),
+            lambda nextnode: nextnode is None or nextnode.final, None)
+
+    def crosscheck_bits(self, above, below):
+        """ Return a bit pattern of the letters that form a valid word
+            when placed between the above and below strings """
+        if self._nodes is None:
+            return 0
+        return _crosscheck_bits(above, below, self._nodes[0],
+            lambda node, depth: node.edges.iteritems(),
+            lambda nextnode: nextnode is None or nextnode.final, None)
+
     def find_matches(self, pattern, sort=True):
         """ Returns a list of words matching a pattern.
             The pattern contains characters and '?'-signs denoting wildcards.
@@ -221,54 +274,402 @@ class DawgDictionary:
     def resume_navigation(self, nav, prefix, nextnode, leftpart):
         return Navigation(nav).resume(prefix, nextnode, leftpart)
 
+    # noinspection PyMethodMayBeStatic
+    def is_compiled(self):
+        """ The text-based DAWG is never compiled into flat tables """
+        return False
+
+
+class BloomFilter:
+
+    """ A probabilistic set membership filter, used to quickly reject words
+        that are not in a DAWG without navigating the graph. Words that are
+        reported as not present are definitely not in the DAWG, while words
+        reported as present are in it with a high probability.
+
+        The filter is stored in an optional section of the packed DAWG
+        file (see DawgHeader), so it always matches the graph it was built from.
+    """
+
+    MAGIC = b"DBLM"
+    VERSION = 2
+    # Magic, version, number of hashes, number of bits
+    HEADER = struct.Struct("<4sHHL")
+    # Two 64-bit hashes are extracted from the MD5 digest of a word
+    _HASHES = struct.Struct("<QQ")
+
+    def __init__(self, num_bits, num_hashes, bits = None):
+        self._num_bits = num_bits
+        self._num_hashes = num_hashes
+        self._bits = bytearray((num_bits + 7) // 8) if bits is None else bits
+
+    @classmethod
+    def for_capacity(cls, num_words, bits_per_word = 10):
+        """ Create an empty filter sized for the given number of words.
+            10 bits per word give a false positive rate of about 1%. """
+        num_bits = max(64, num_words * bits_per_word)
+        # The optimal number of hash functions is ln(2) * bits per word
+        num_hashes = max(1, int(round(0.693 * bits_per_word)))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, word):
+        """ Generate the bit positions of a word, using double hashing """
+        h1, h2 = self._HASHES.unpack(hashlib.md5(word.encode('utf-8')).digest())
+        m = self._num_bits
+        for i in range(self._num_hashes):
+            yield (h1 + i * h2) % m
+
+    def add(self, word):
+        """ Add a word to the filter """
+        bits = self._bits
+        for pos in self._positions(word):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, word):
+        """ Returns False if the word is definitely not in the set """
+        bits = self._bits
+        for pos in self._positions(word):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def to_bytes(self):
+        """ Return the binary representation of the filter """
+        return self.HEADER.pack(self.MAGIC, self.VERSION,
+            self._num_hashes, self._num_bits) + bytes(self._bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Create a filter from its binary representation,
+            returning None if the data is invalid """
+        if len(data) < cls.HEADER.size:
+            return None
+        magic, version, num_hashes, num_bits = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            return None
+        if len(data) != cls.HEADER.size + (num_bits + 7) // 8:
+            # Truncated or otherwise corrupt data
+            return None
+        return cls(num_bits, num_hashes, bytearray(data[cls.HEADER.size:]))
+
+
+class DawgHeader:
+
+    """ The header of a packed DAWG file. It identifies the file format and
+        describes the graph, so that a loader can validate the file in
+        constant time, before navigating it.
+
+        The header consists of a fixed part, followed by the alphabet
+        used to code the letters of the graph (in UTF-8) and a table of
+        optional sections. The graph follows the header, and the sections
+        follow the graph. Section offsets are from the start of the file.
+    """
+
+    MAGIC = b"SKDG"
+    VERSION = 1
+    # Magic, version, header size, node count, edge count, word count,
+    # graph size, graph CRC32, alphabet size, number of sections
+    FIXED = struct.Struct("<4sHHLLLLLHH")
+    # Section tag, offset, size
+    SECTION = struct.Struct("<4sLL")
+
+    # Section containing a negative lookup filter (see BloomFilter)
+    FILTER = b"BLOM"
+
+    def __init__(self, alphabet, num_nodes, num_edges, num_words,
+        graph_size, graph_crc, sections = None):
+        self.alphabet = alphabet
+        self.num_nodes = num_nodes
+        self.num_edges = num_edges
+        self.num_words = num_words
+        self.graph_size = graph_size
+        self.graph_crc = graph_crc
+        # Dict of section tag : (offset, size)
+        self.sections = dict() if sections is None else sections
+        self.size = (self.FIXED.size + len(alphabet.encode('utf-8')) +
+            self.SECTION.size * len(self.sections))
+
+    @staticmethod
+    def checksum(graph):
+        """ Return the CRC32 checksum of a packed graph """
+        return zlib.crc32(buffer(graph)) & 0xffffffff
+
+    @classmethod
+    def pack_file(cls, alphabet, graph, num_nodes, num_edges, num_words, sections = None):
+        """ Return the contents of a packed DAWG file, i.e. the header,
+            the graph and the sections, given as a list of (tag, data) tuples """
+        sections = sections or []
+        alpha = alphabet.encode('utf-8')
+        size = cls.FIXED.size + len(alpha) + cls.SECTION.size * len(sections)
+        parts = [
+            cls.FIXED.pack(cls.MAGIC, cls.VERSION, size, num_nodes, num_edges, num_words,
+                len(graph), cls.checksum(graph), len(alpha), len(sections)),
+            alpha
+        ]
+        offset = size + len(graph)
+        for tag, data in sections:
+            parts.append(cls.SECTION.pack(tag, offset, len(data)))
+            offset += len(data)
+        parts.append(bytes(graph))
+        parts.extend(data for tag, data in sections)
+        return b"".join(parts)
+
+    @classmethod
+    def parse(cls, data, alphabet):
+        """ Parse and validate the header at the start of a packed DAWG file,
+            whose contents can be a byte string or a memory map. Raises
+            ValueError if the header is invalid, does not match the given
+            alphabet or does not fit the file. """
+        file_size = len(data)
+        if file_size < cls.FIXED.size:
+            raise ValueError(u"File is too short")
+        (magic, version, size, num_nodes, num_edges, num_words,
+            graph_size, graph_crc, alpha_size, num_sections) = cls.FIXED.unpack(data[0:cls.FIXED.size])
+        if magic != cls.MAGIC:
+            raise ValueError(u"File is not a packed DAWG")
+        if version != cls.VERSION:
+            raise ValueError(u"Unsupported version {0}".format(version))
+        if size != cls.FIXED.size + alpha_size + cls.SECTION.size * num_sections or size > file_size:
+            raise ValueError(u"Invalid header size")
+        pos = cls.FIXED.size
+        try:
+            alpha = data[pos:pos + alpha_size].decode('utf-8')
+        except UnicodeDecodeError:
+            raise ValueError(u"Invalid alphabet")
+        if alpha != alphabet:
+            raise ValueError(u"Alphabet mismatch")
+        if graph_size == 0 or size + graph_size > file_size:
+            raise ValueError(u"Graph is truncated")
+        pos += alpha_size
+        sections = dict()
+        for _ in range(num_sections):
+            tag, offset, length = cls.SECTION.unpack(data[pos:pos + cls.SECTION.size])
+            if offset < size + graph_size or offset + length > file_size:
+                raise ValueError(u"Section is truncated")
+            sections[tag] = (offset, length)
+            pos += cls.SECTION.size
+        return cls(alpha, num_nodes, num_edges, num_words, graph_size, graph_crc, sections)
+
+    def section(self, data, tag):
+        """ Return the contents of a section from the file data, or None if not present """
+        if tag not in self.sections:
+            return None
+        offset, length = self.sections[tag]
+        return data[offset:offset + length]
+
+
+def _find_many(words, root, edges, is_final, nonode):
+    """ Look up a batch of words in a graph, returning a list of booleans
+        indicating whether each word is found. The words are visited in
+        sorted order and the graph positions along the path of the
+        previous word are kept, so that a common prefix is only traversed
+        once. edges(node, depth) returns an iterator over the (prefix, nextnode)
+        edges of a node, is_final(nextnode) returns True if a word is
+        completed at the end of an edge leading to nextnode, and nonode is
+        the value of nextnode for edges that do not lead to another node. """
+    found = dict()
+    # path[i] is the graph position after matching the first i letters of
+    # the previous word, as a tuple (rest of edge prefix, next node, final)
+    path = [(u'', root, False)]
+    last = u''
+    for word in sorted(set(words)):
+        # Go back to the position after the prefix shared with the previous word
+        common = 0
+        limit = min(len(word), len(last), len(path) - 1)
+        while common < limit and word[common] == last[common]:
+            common += 1
+        del path[common + 1:]
+        rest, node, final = path[-1]
+        for depth in range(common, len(word)):
+            ch = word[depth]
+            if not rest:
+                # At a node: find the outgoing edge starting with the letter
+                if node == nonode and depth > 0:
+                    break
+                for prefix, nextnode in edges(node, depth):
+                    if prefix[0] == ch:
+                        rest, node = prefix, nextnode
+                        break
+                else:
+                    break
+            elif rest[0] != ch:
+                break
+            rest = rest[1:]
+            if rest:
+                final = rest[0] == u'|'
+                if final:
+                    rest = rest[1:]
+            else:
+                final = is_final(node)
+            path.append((rest, node, final))
+        found[word] = bool(word and len(path) == len(word) + 1 and path[-1][2])
+        last = word
+    return [found[w] for w in words]
+
+
+def _crosscheck_bits(above, below, root, edges, is_final, nonode):
+    """ Return a bit pattern of the letters that form a valid word in
+        the graph when placed between the above and below strings.
+        The graph is walked once, branching only at the position between
+        the strings. The edges, is_final and nonode parameters are as
+        for _find_many(). """
+
+    def advance(rest, node, depth, s):
+        """ Match the string s starting at the graph position given by
+            the rest of the current edge prefix and the next node, returning
+            the resulting (rest, node, final) position or None if no match """
+        final = False
+        for ch in s:
+            if not rest:
+                # At a node: find the outgoing edge starting with the letter
+                if node is None:
+                    return None
+                for prefix, nextnode in edges(node, depth):
+                    if prefix[0] == ch:
+                        rest, node = prefix, nextnode
+                        break
+                else:
+                    return None
+            elif rest[0] != ch:
+                return None
+            rest = rest[1:]
+            depth += 1
+            if rest:
+                final = rest[0] == u'|'
+                if final:
+                    rest = rest[1:]
+            else:
+                final = is_final(node)
+            if not rest and node == nonode:
+                # At the end of an edge that does not lead to another node
+                node = None
+        return rest, node, final
+
+    pos = advance(u'', root, 0, above)
+    if pos is None:
+        return 0
+    rest, node, _ = pos
+    depth = len(above)
+    if rest:
+        # In the middle of an edge: only one letter can follow
+        letters = rest[0]
+    elif node is None:
+        return 0
+    else:
+        letters = [prefix[0] for prefix, _ in edges(node, depth)]
+    bits = 0
+    letter_bit = Alphabet.letter_bit
+    for ch in letters:
+        pos = advance(rest, node, depth, ch + below)
+        if pos is not None and pos[2]:
+            bits |= letter_bit.get(ch, 0)
+    return bits
+
 
 class Wordbase:
 
-    """ Container for two singleton instances of the word database,
-        one for the main dictionary and the other for common words
+    """ Registry of named word databases, each loaded on first use.
+
+        The main dictionary ('main'), the common words dictionary ('common')
+        and the GADDAG for the main dictionary ('gaddag') are registered by
+        default. Reading a dictionary that has been loaded does not require
+        any locking, and loaded dictionaries can be replaced atomically with
+        freshly built ones by calling reload().
     """
 
-    _dawg = None
-    _dawg_common = None
+    # Registered dictionaries: name -> (resource name, True if a GADDAG)
+    _registry = {
+        "main": ("ordalisti", False),
+        "common": ("algeng", False),
+        "gaddag": ("ordalisti", True)
+    }
 
+    # Loaded dictionaries by name. A GADDAG that has not been built is
+    # represented by False. The dict is never modified after it has been
+    # published; a modified copy is published instead, by a single (atomic)
+    # assignment, so that readers never need to acquire a lock.
+    _dicts = dict()
+
+    # Serializes updates of the registry and publication of loaded dictionaries
     _lock = threading.Lock()
-    _lock_common = threading.Lock()
+    # Serializes the loading of each registered dictionary
+    _locks = { name: threading.Lock() for name in _registry }
+    # Serializes reloads
+    _lock_reload = threading.Lock()
+    # Functions to call, without arguments, after dictionaries have been reloaded
+    _reload_listeners = []
+
+    # Background warmup state. The ready event is set when all dictionaries
+    # have been loaded and their navigation caches primed (or have failed to load).
+    _ready = threading.Event()
+    _lock_warmup = threading.Lock()
+    _warmup_thread = None
+    _warmup_time = None
+    # Names of dictionaries that failed to load during warmup and have not been loaded since
+    _warmup_failed = []
+    # Whether GADDAGs are warmed up as well
+    _warmup_gaddags = False
+
+    # Representative queries used to prime the navigation caches during warmup
+    _WARMUP_WORDS = [
+        u"upphitun", u"prófun", u"halló", u"blús", u"eipaði", u"drenið",
+        u"nafnskírteinið", u"abstraktmálari", u"hraðlestu", u"borðaðirðu",
+        u"að", u"ef", u"ós", u"þú", u"öx", u"sértu", u"vísla", u"ógjörla"
+    ]
+    _WARMUP_RACKS = [u"einstök", u"aeinrst", u"pr?óf", u"?urð?"]
+    _WARMUP_CROSSCHECKS = [
+        (u"", u"að"), (u"ha", u""), (u"b", u"r"), (u"s", u"ó"), (u"", u"ur"), (u"hú", u"")
+    ]
+
+    # Memory-map binary DAWG files if possible, instead of reading them into memory
+    _use_mmap = True
+    # Compile binary DAWGs into flat node and edge tables after loading.
+    # This speeds up navigation at the cost of per-process memory and startup time.
+    _compile = False
 
     def __init__(self):
         pass
 
     @staticmethod
     def _load_resource(resource):
-        """ Load a dictionary, from either a text file or a pickle file """
-        # Assumes that the appropriate lock has been acquired
-        # Compare the file times of the text version vs. the pickled version
+        """ Load a dictionary from a binary file, or, if it is missing or
+            invalid, from either a text file or a pickle file """
         bname = os.path.abspath(os.path.join("resources", resource + ".bin.dawg"))
         pname = os.path.abspath(os.path.join("resources", resource + ".dawg.pickle"))
         fname = os.path.abspath(os.path.join("resources", resource + ".text.dawg"))
+        t0 = time.time()
+        dawg = PackedDawgDictionary()
+        try:
+            # The binary file header is validated when loading
+            dawg.load(bname, use_mmap = Wordbase._use_mmap)
+        except EnvironmentError:
+            dawg = None
+        except ValueError as e:
+            logging.warning(u"Invalid binary DAWG file {0}: {1}".format(bname, e))
+            dawg = None
+
+        if dawg is not None:
+            t1 = time.time()
+            logging.info(u"Instance {0} loaded DAWG of {1} words from binary file {2} in {3:.2f} seconds{4}"
+                .format(os.environ.get("INSTANCE_ID", ""), dawg.num_words(), bname, t1 - t0,
+                    u" (memory-mapped)" if dawg.is_mapped() else u""))
+            if Wordbase._compile:
+                dawg.compile()
+                t2 = time.time()
+                logging.info(u"Compiled graph to flat tables in {0:.2f} seconds".format(t2 - t1))
+            return dawg
+
+        # No valid binary file: compare the file times of the text version vs. the pickled version
         try:
             fname_t = os.path.getmtime(fname)
         except os.error:
             fname_t = None
-        try:
-            bname_t = os.path.getmtime(bname)
-        except os.error:
-            bname_t = None
         try:
             pname_t = os.path.getmtime(pname)
         except os.error:
             pname_t = None
 
-        if bname_t is not None and (fname_t is None or bname_t > fname_t):
-            # Load binary file if it exists and is newer than the text file
-            logging.info(u"Instance {0} loading DAWG from binary file {1}"
-                .format(os.environ.get("INSTANCE_ID", ""), bname))
-            # print("Loading binary DAWG")
-            t0 = time.time()
-            dawg = PackedDawgDictionary()
-            dawg.load(bname)
-            t1 = time.time()
-            logging.info(u"Loaded complete graph in {0:.2f} seconds".format(t1 - t0))
-        elif fname_t is not None and (pname_t is None or fname_t > pname_t):
+        if fname_t is not None and (pname_t is None or fname_t > pname_t):
             # We have a newer text file (or no pickle): load it
             logging.info(u"Instance {0} loading DAWG from text file {1}"
                 .format(os.environ.get("INSTANCE_ID", ""), fname))
@@ -289,26 +690,221 @@ class Wordbase:
             t1 = time.time()
             logging.info(u"Loaded {0} graph nodes in {1:.2f} seconds".format(dawg.num_nodes(), t1 - t0))
 
-        # Do not assign Wordbase._dawg until fully loaded, to prevent race conditions
         return dawg
 
+    @staticmethod
+    def _load_gaddag(resource):
+        """ Load a GADDAG from a binary file, returning False if it has not been built """
+        gname = os.path.abspath(os.path.join("resources", resource + ".bin.gaddag"))
+        t0 = time.time()
+        gaddag = PackedDawgDictionary()
+        try:
+            gaddag.load(gname, use_mmap = Wordbase._use_mmap)
+        except EnvironmentError:
+            return False
+        except ValueError as e:
+            logging.warning(u"Invalid GADDAG file {0}: {1}".format(gname, e))
+            return False
+        if Wordbase._compile:
+            gaddag.compile()
+        t1 = time.time()
+        logging.info(u"Loaded GADDAG from {0} in {1:.2f} seconds".format(gname, t1 - t0))
+        return gaddag
+
+    @staticmethod
+    def _load_registered(name):
+        """ Load a registered dictionary from its resource files """
+        resource, is_gaddag = Wordbase._registry[name]
+        if is_gaddag:
+            return Wordbase._load_gaddag(resource)
+        return Wordbase._load_resource(resource)
+
+    @staticmethod
+    def _publish(dicts):
+        """ Atomically publish a set of loaded dictionaries, returning
+            the previously published dictionaries """
+        with Wordbase._lock:
+            previous = Wordbase._dicts
+            published = dict(previous)
+            published.update(dicts)
+            Wordbase._dicts = published
+            # Dictionaries that have now been loaded are no longer failures
+            Wordbase._warmup_failed = [name for name in Wordbase._warmup_failed if name not in dicts]
+        return previous
+
+    @staticmethod
+    def register(name, resource, gaddag = False):
+        """ Register a dictionary name for a resource, i.e. a set of files
+            in the resources directory. If gaddag is True, the name refers
+            to the GADDAG built from the resource. """
+        with Wordbase._lock:
+            entry = (resource, gaddag)
+            if Wordbase._registry.get(name, entry) != entry:
+                raise ValueError(u"Dictionary {0} is already registered".format(name))
+            registry = dict(Wordbase._registry)
+            registry[name] = entry
+            locks = dict(Wordbase._locks)
+            locks.setdefault(name, threading.Lock())
+            Wordbase._locks = locks
+            Wordbase._registry = registry
+
+    @staticmethod
+    def names():
+        """ Return the names of all registered dictionaries """
+        return sorted(Wordbase._registry.keys())
+
+    @staticmethod
+    def get(name):
+        """ Return the named dictionary, loading it if required,
+            or None if it is a GADDAG that has not been built """
+        d = Wordbase._dicts.get(name)
+        if d is None:
+            # Not loaded yet: load it, unless another thread beats us to it
+            with Wordbase._locks[name]:
+                d = Wordbase._dicts.get(name)
+                if d is None:
+                    d = Wordbase._load_registered(name)
+                    Wordbase._publish({ name : d })
+        return d or None
+
+    @staticmethod
+    def reload(*names):
+        """ Load fresh copies of the named dictionaries (by default, all loaded
+            dictionaries) from their resource files and swap them in atomically,
+            as a group. Other loaded dictionaries built from the same resources,
+            such as the GADDAG of the main dictionary, are reloaded as well.
+            Dictionaries that are in use while being swapped out remain valid. """
+        with Wordbase._lock_reload:
+            loaded = Wordbase._dicts
+            resources = set(Wordbase._registry[name][0] for name in (names or loaded.keys()))
+            names = set(names).union(name for name in loaded
+                if Wordbase._registry[name][0] in resources)
+            t0 = time.time()
+            fresh = { name : Wordbase._load_registered(name) for name in names }
+            previous = Wordbase._publish(fresh)
+            logging.info(u"Instance {0} reloaded dictionaries {1} in {2:.2f} seconds"
+                .format(os.environ.get("INSTANCE_ID", ""), u", ".join(sorted(names)), time.time() - t0))
+        # Release the navigation caches of the dictionaries that were swapped out
+        for name in names:
+            d = previous.get(name)
+            if isinstance(d, PackedDawgDictionary):
+                d.release_caches()
+        for listener in Wordbase._reload_listeners:
+            listener()
+
+    @staticmethod
+    def add_reload_listener(listener):
+        """ Register a function to be called, without arguments, after
+            dictionaries have been reloaded, to discard any state derived
+            from the dictionaries that were swapped out """
+        with Wordbase._lock:
+            Wordbase._reload_listeners = Wordbase._reload_listeners + [listener]
+
     @staticmethod
     def dawg():
         """ Return the main dictionary DAWG object, loading it if required """
-        with Wordbase._lock:
-            if Wordbase._dawg is None:
-                Wordbase._dawg = Wordbase._load_resource("ordalisti") # Main dictionary
-            assert Wordbase._dawg is not None
-            return Wordbase._dawg
+        return Wordbase.get("main")
 
     @staticmethod
     def dawg_common():
         """ Return the common words DAWG object, loading it if required """
-        with Wordbase._lock_common:
-            if Wordbase._dawg_common is None:
-                Wordbase._dawg_common = Wordbase._load_resource("algeng") # Common words
-            assert Wordbase._dawg_common is not None
-            return Wordbase._dawg_common
+        return Wordbase.get("common")
+
+    @staticmethod
+    def gaddag():
+        """ Return the GADDAG for the main dictionary, loading it if required,
+            or None if it has not been built """
+        return Wordbase.get("gaddag")
+
+    @staticmethod
+    def _prime_dawg(dawg):
+        """ Prime the navigation caches of a DAWG with a representative query set """
+        dawg.find_many(Wordbase._WARMUP_WORDS)
+        for above, below in Wordbase._WARMUP_CROSSCHECKS:
+            dawg.crosscheck_bits(above, below)
+        for rack in Wordbase._WARMUP_RACKS:
+            dawg.find_permutations(rack)
+
+    @staticmethod
+    def _prime_gaddag(gaddag):
+        """ Prime the navigation caches of a GADDAG by looking up
+            the GADDAG strings of a representative word set """
+        sep = GADDAG_SEPARATOR
+        gaddag.find_many([w[i::-1] + sep + w[i + 1:]
+            for w in Wordbase._WARMUP_WORDS for i in range(len(w))])
+
+    @staticmethod
+    def _warmup_one(name):
+        """ Load and prime a single dictionary, in a background thread """
+        try:
+            dawg = Wordbase.get(name)
+            if dawg is not None:
+                if Wordbase._registry[name][1]:
+                    Wordbase._prime_gaddag(dawg)
+                else:
+                    Wordbase._prime_dawg(dawg)
+        except Exception as e:
+            # The dictionary will be loaded again on first use,
+            # raising the error in the context of a request
+            logging.error(u"Warmup of dictionary {0} failed: {1}".format(name, e))
+            with Wordbase._lock:
+                Wordbase._warmup_failed = Wordbase._warmup_failed + [name]
+
+    @staticmethod
+    def _warmup():
+        """ Load all dictionaries in parallel, then signal readiness """
+        t0 = time.time()
+        threads = [
+            threading.Thread(target = Wordbase._warmup_one, args = (name,),
+                name = "warmup-" + name)
+            for name in Wordbase.names()
+            if Wordbase._warmup_gaddags or not Wordbase._registry[name][1]
+        ]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        Wordbase._warmup_time = time.time() - t0
+        Wordbase._ready.set()
+        logging.info(u"Instance {0} warmed up in {1:.2f} seconds"
+            .format(os.environ.get("INSTANCE_ID", ""), Wordbase._warmup_time))
+
+    @staticmethod
+    def start_warmup(gaddags = False):
+        """ Start loading and priming all registered dictionaries in background threads,
+            returning immediately. GADDAGs are large and only used by some robot
+            levels, so they are skipped unless gaddags is True.
+            Only the first call has any effect. """
+        with Wordbase._lock_warmup:
+            if Wordbase._warmup_thread is None:
+                Wordbase._warmup_gaddags = gaddags
+                t = threading.Thread(target = Wordbase._warmup, name = u"warmup")
+                t.daemon = True
+                Wordbase._warmup_thread = t
+                t.start()
+
+    @staticmethod
+    def is_ready():
+        """ Return True if the warmup has completed """
+        return Wordbase._ready.is_set()
+
+    @staticmethod
+    def wait_ready(timeout = None):
+        """ Wait until the warmup has completed, starting it if required.
+            Returns True if ready, or False if the timeout (in seconds) expired. """
+        Wordbase.start_warmup()
+        return Wordbase._ready.wait(timeout)
+
+    @staticmethod
+    def warmup_status():
+        """ Return a dict describing the state of the warmup """
+        return dict(
+            started = Wordbase._warmup_thread is not None,
+            ready = Wordbase._ready.is_set(),
+            seconds = Wordbase._warmup_time,
+            failed = list(Wordbase._warmup_failed)
+        )
 
 
 class Navigation:
@@ -395,6 +991,100 @@ class Navigation:
         self._navigate_from_edge(prefix, nextnode, matched)
 
 
+class NavigatorConstraints:
+
+    """ Declarative description of the words that a navigator accepts,
+        allowing PackedNavigation to traverse the graph iteratively
+        without calling back into the navigator for every letter.
+        All lists are indexed by depth, i.e. the number of letters matched.
+
+        Letters are handled internally as integer codes, i.e. indices
+        into Alphabet.all_tiles, and words are only converted to strings
+        when they are reported.
+
+        maxlen
+            The maximum number of letters to match.
+        allowed
+            For each depth, a bit pattern of the letters allowed there
+            (see Alphabet.letter_bit), or None if any letter is allowed.
+        ends
+            For each depth from 0 to maxlen inclusive, True if a word
+            ending at that length should be reported.
+        report
+            Called with the matched word for each final word of a length
+            marked in ends.
+        rack
+            If not None, a list of tile counts indexed by tile code that
+            letters are taken from, with Alphabet.BLANK denoting blank tiles
+            matching any letter. The list is modified during navigation
+            but restored when it completes.
+        free
+            If not None, for each depth, True if the letter there is not
+            taken from the rack (e.g. because it is already on the board).
+    """
+
+    def __init__(self, maxlen, allowed, ends, report, rack = None, free = None):
+        self.maxlen = maxlen
+        self.allowed = allowed
+        self.ends = ends
+        self.report = report
+        self.rack = rack
+        self.free = free
+
+    @staticmethod
+    def rack_counts(rack):
+        """ Return a list of tile counts for a rack string """
+        return Alphabet.tile_counts(rack)
+
+    @staticmethod
+    def letter_bits(s):
+        """ Return a list of letter bits for the letters in a string,
+            where wildcards ('?') map to None """
+        letter_bit = Alphabet.letter_bit
+        return [None if c == u'?' else letter_bit.get(c, 0) for c in s]
+
+
+class GaddagConstraints:
+
+    """ Declarative description of the words to be generated through an
+        anchor square by PackedDawgDictionary.navigate_gaddag(). Words are
+        generated by first placing letters leftwards, starting at the anchor
+        square, and then rightwards from the square to the right of the anchor.
+        Letters are handled as integer codes, as in NavigatorConstraints.
+
+        left_allowed, left_free
+            For each distance d from the anchor going left (d = 0 is the
+            anchor itself), a bit pattern of the letters allowed in the
+            square, and True if the letter is not taken from the rack.
+            The lists end where no more letters can be placed on the left.
+        left_turn
+            For each number d of letters placed leftwards (0..len(left_allowed)),
+            True if the word can start at the leftmost of them.
+        right_allowed, right_free
+            As for the left side, for each distance k to the right of the anchor
+            (k = 0 is the square to the right of the anchor).
+        right_ends
+            For each number k of letters placed on the right of the
+            anchor (0..len(right_allowed)), True if a word can end there.
+        rack
+            A list of tile counts indexed by tile code, as in NavigatorConstraints.
+        report
+            Called with each word found and the number of its letters that
+            are at or to the left of the anchor square.
+    """
+
+    def __init__(self, left_allowed, left_free, left_turn,
+        right_allowed, right_free, right_ends, rack, report):
+        self.left_allowed = left_allowed
+        self.left_free = left_free
+        self.left_turn = left_turn
+        self.right_allowed = right_allowed
+        self.right_free = right_free
+        self.right_ends = right_ends
+        self.rack = rack
+        self.report = report
+
+
 class FindNavigator:
 
     """ A navigation class to be used with DawgDictionary.navigate()
@@ -444,6 +1134,17 @@ class FindNavigator:
     def is_found(self):
         return self._found
 
+    def constraints(self, depth):
+        """ Describe this navigator declaratively for iterative navigation """
+        ends = [False] * (self._len + 1)
+        ends[self._len] = True
+        return NavigatorConstraints(self._len, NavigatorConstraints.letter_bits(self._word),
+            ends, self._report)
+
+    def _report(self, matched):
+        """ Called by iterative navigation when the word is found """
+        self._found = True
+
 
 class PermutationNavigator:
 
@@ -505,6 +1206,13 @@ class PermutationNavigator:
     def result(self):
         return self._result
 
+    def constraints(self, depth):
+        """ Describe this navigator declaratively for iterative navigation """
+        maxlen = len(self._rack)
+        ends = [0 < n and n >= self._minlen for n in range(maxlen + 1)]
+        return NavigatorConstraints(maxlen, [None] * maxlen, ends, self._result.append,
+            rack = NavigatorConstraints.rack_counts(self._rack))
+
 
 class MatchNavigator:
 
@@ -568,6 +1276,13 @@ class MatchNavigator:
     def result(self):
         return self._result
 
+    def constraints(self, depth):
+        """ Describe this navigator declaratively for iterative navigation """
+        ends = [False] * (self._lenp + 1)
+        ends[self._lenp] = True
+        return NavigatorConstraints(self._lenp, NavigatorConstraints.letter_bits(self._pattern),
+            ends, self._result.append)
+
 
 class PackedDawgDictionary:
 
@@ -577,26 +1292,122 @@ class PackedDawgDictionary:
     def __init__(self):
         # The packed byte buffer
         self._b = None
+        # The memory map underlying the byte buffer, if the file is mapped
+        self._mm = None
+        # Flat node and edge tables, if the graph has been compiled
+        self._table = None
+        # Optional filter for quick rejection of words not in the graph
+        self._filter = None
+        # The header of the file that the DAWG was loaded from
+        self._header = None
         # Lock to ensure that only one thread loads the dictionary
         self._lock = threading.Lock()
 
-    def load(self, fname):
-        """ Load a packed DAWG from a binary file """
+    @staticmethod
+    def can_mmap():
+        """ Returns True if memory-mapped loading is supported in this environment """
+        return mmap is not None and ctypes is not None
+
+    @staticmethod
+    def _map(fname):
+        """ Memory-map a packed DAWG file """
+        with open(fname, mode='rb') as fin:
+            # ctypes requires a writable buffer, so we use a copy-on-write
+            # mapping. The DAWG is never written to, so the pages stay shared
+            # with other processes through the OS page cache.
+            return mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def load(self, fname, use_mmap = False):
+        """ Load a packed DAWG from a binary file. If use_mmap is True and
+            memory mapping is supported, the file is mapped copy-on-write
+            and navigated in place instead of being read into memory. The
+            mapping is never written to, so its pages stay shared with other
+            processes through the OS page cache.
+            Raises ValueError if the file header is invalid. """
         with self._lock:
             # Ensure that we don't have multiple threads trying to load simultaneously
             if self._b is not None:
                 # Already loaded
                 return
-            # Quickly gulp the file contents into the byte buffer
-            with open(fname, mode='rb') as fin:
-                self._b = bytearray(fin.read())
+            mm = None
+            if use_mmap and self.can_mmap():
+                try:
+                    mm = self._map(fname)
+                except (EnvironmentError, ValueError) as e:
+                    # Fall back to reading the file into memory
+                    logging.warning(u"Unable to memory-map DAWG file {0}: {1}".format(fname, e))
+            if mm is None:
+                # Quickly gulp the file contents into memory
+                with open(fname, mode='rb') as fin:
+                    data = fin.read()
+            else:
+                data = mm
+            # Validate the header before touching the graph
+            header = DawgHeader.parse(data, PackedNavigation.ALPHABET)
+            flt = header.section(data, DawgHeader.FILTER)
+            if flt is not None:
+                self._filter = BloomFilter.from_bytes(flt)
+            if mm is None:
+                self._b = bytearray(buffer(data, header.size, header.graph_size))
+            else:
+                # A ctypes byte array indexes as integers, just like a bytearray,
+                # and supports the buffer interface used by struct.unpack_from()
+                self._b = (ctypes.c_ubyte * header.graph_size).from_buffer(mm, header.size)
+                self._mm = mm
+            self._header = header
+
+    def verify(self):
+        """ Returns True if the graph matches the checksum in its file header.
+            This reads the whole graph and is therefore not done when loading. """
+        return self._b is not None and DawgHeader.checksum(self._b) == self._header.graph_crc
+
+    def is_mapped(self):
+        """ Returns True if the DAWG is navigated in place in a memory-mapped file """
+        return self._mm is not None
+
+    def compile(self):
+        """ Convert the packed byte buffer into flat node and edge tables,
+            which are subsequently used for navigation instead of the buffer.
+            This is a one-time operation that trades some memory and
+            startup time for faster navigation. """
+        with self._lock:
+            if self._table is None and self._b is not None:
+                self._table = _DawgTable(self._b)
+
+    def is_compiled(self):
+        """ Returns True if the DAWG has been compiled into flat tables """
+        return self._table is not None
+
+    def release_caches(self):
+        """ Discard the shared navigation caches for this DAWG, which is being
+            swapped out. Navigations in progress are not affected. """
+        if self._b is not None:
+            PackedNavigation.release_caches(self._b)
+
+    def __del__(self):
+        # The caches refer to the byte buffer but not to the dictionary,
+        # so they would otherwise outlive a discarded dictionary.
+        # At interpreter exit, the module globals may already be gone.
+        if PackedNavigation is not None:
+            self.release_caches()
+
+    def has_filter(self):
+        """ Returns True if the DAWG has a negative lookup filter """
+        return self._filter is not None
 
     def num_nodes(self):
         """ Return a count of unique nodes in the DAWG """
-        return 0 # !!! TBD - maybe not required
+        return 0 if self._header is None else self._header.num_nodes
+
+    def num_words(self):
+        """ Return a count of the words in the DAWG """
+        return 0 if self._header is None else self._header.num_words
 
     def find(self, word):
         """ Look for a word in the graph, returning True if it is found or False if not """
+        if self._filter is not None and word not in self._filter:
+            # Definitely not in the graph
+            return False
         nav = FindNavigator(word)
         self.navigate(nav)
         return nav.is_found()
@@ -605,6 +1416,34 @@ class PackedDawgDictionary:
         """ Enable simple lookup syntax: "word" in dawgdict """
         return self.find(word)
 
+    def find_many(self, words):
+        """ Look for a batch of words in the graph, returning a list
+            of booleans indicating whether each word is found """
+        if self._b is None:
+            return [False] * len(words)
+        bf = self._filter
+        # Only look in the graph for the words that pass the filter, if any
+        candidates = words if bf is None else [w for w in words if w in bf]
+        if not candidates:
+            return [False] * len(words)
+        if self._table is not None:
+            found = CompiledNavigation(None, self._table).find_many(candidates)
+        else:
+            found = PackedNavigation(None, self._b).find_many(candidates)
+        if bf is None:
+            return found
+        found = set(w for w, f in zip(candidates, found) if f)
+        return [w in found for w in words]
+
+    def crosscheck_bits(self, above, below):
+        """ Return a bit pattern of the letters that form a valid word
+            when placed between the above and below strings """
+        if self._b is None:
+            return 0
+        if self._table is not None:
+            return CompiledNavigation(None, self._table).crosscheck_bits(above, below)
+        return PackedNavigation(None, self._b).crosscheck_bits(above, below)
+
     def find_matches(self, pattern, sort=True):
         """ Returns a list of words matching a pattern.
             The pattern contains characters and '?'-signs denoting wildcards.
@@ -644,53 +1483,154 @@ class PackedDawgDictionary:
                 if there is no need to visit other edges
             def done()
                 called when the navigation is completed
+
+            Alternatively, the navigation object can implement
+
+            def constraints(depth)
+                returns a NavigatorConstraints instance describing the
+                words it accepts, starting at the given depth, or None.
+                The graph is then traversed iteratively without calling
+                the per-letter functions above, although done() is still called.
         """
         if self._b is None:
             # No graph: no navigation
             nav.done()
+        elif self._table is not None:
+            CompiledNavigation(nav, self._table).go()
         else:
             PackedNavigation(nav, self._b).go()
 
+    def navigate_gaddag(self, constraints):
+        """ Generate words through an anchor square, as described by a
+            GaddagConstraints object. This graph must be a GADDAG. """
+        if self._b is None:
+            return
+        if self._table is not None:
+            CompiledNavigation(None, self._table).navigate_gaddag(constraints)
+        else:
+            PackedNavigation(None, self._b).navigate_gaddag(constraints)
+
     def resume_navigation(self, nav, prefix, nextnode, leftpart):
+        if self._table is not None:
+            return CompiledNavigation(nav, self._table).resume(prefix, nextnode, leftpart)
         return PackedNavigation(nav, self._b).resume(prefix, nextnode, leftpart)
 
 
+class _CacheBudget:
+
+    """ The budget of unpinned entries shared by a group of edge caches.
+        When the budget is exceeded, the oldest entries of the group are
+        evicted, whichever caches they are in, so that each cache keeps
+        a share of the budget that follows its recent use. """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        # Serializes updates of the caches in the group. This is reentrant
+        # since a cache can be cleared by a garbage-collected dictionary
+        # while the lock is held.
+        self.lock = threading.RLock()
+        # The unpinned entries of all caches, in the order they were stored,
+        # as (cache, offset) tuples
+        self._order = deque()
+
+    def used(self):
+        """ Return the number of unpinned entries held by the caches """
+        return len(self._order)
+
+    def add(self, cache, offset):
+        """ Account for an entry stored in a cache, evicting the oldest
+            entries if required. Called with the lock held. """
+        self._order.append((cache, offset))
+        self.trim()
+
+    def trim(self):
+        """ Evict the oldest entries until the budget is met. Called with the lock held. """
+        while len(self._order) > self.max_entries:
+            cache, offset = self._order.popleft()
+            cache.evict(offset)
+
+    def remove(self, cache):
+        """ Forget the entries of a cache that is being cleared. Called with the lock held. """
+        self._order = deque(item for item in self._order if item[0] is not cache)
+
+
 class PackedNavigation:
 
     """ Manages the state for a navigation while it is in progress """
 
-    # Assemble a decoding dictionary where encoded indices are mapped to
-    # characters, eventually with a suffixed vertical bar '|' to denote finality
-    _CODING = { i : c for i, c in enumerate(Alphabet.order) }
-    _CODING.update({ i | 0x80 : c + u"|" for i, c in enumerate(Alphabet.order) })
+    # The letters of the packed format, indexed by their codes. The codes
+    # are the tile codes of Alphabet.tile_index, followed by the GADDAG separator.
+    ALPHABET = Alphabet.all_tiles + GADDAG_SEPARATOR
+    _CODING = { i : c for i, c in enumerate(ALPHABET) }
+    _CODING.update({ i | 0x80 : c + u"|" for i, c in enumerate(ALPHABET) })
+    # Map letters to their codes
+    _CODES = { c : i for i, c in enumerate(ALPHABET) }
 
     # The structure used to decode an edge offset from bytes
     _UINT32 = struct.Struct("<L")
 
-    # Dictionary of edge iteration caches, keyed by byte buffer
+    # Dictionary of edge iteration caches, keyed by byte buffer. Each entry
+    # is a pair of caches, for plain and coded edges respectively.
+    # The entries are removed when their dictionaries are released.
     _iter_caches = dict()
 
+    # Memo of coded prefixes, used when resuming navigation
+    _prefix_codes = dict()
+    PREFIX_CODES_MAX = 20000
+
+    # Maximum number of cached nodes in all edge iteration caches together,
+    # not counting pinned ones
+    CACHE_MAX_ENTRIES = 50000
+    # The budget shared by all edge iteration caches
+    _cache_budget = _CacheBudget(CACHE_MAX_ENTRIES)
+    # Nodes reached with fewer than this number of matched letters are pinned
+    # in the cache. These upper levels of the graph are visited by almost
+    # every navigation and are comparatively few.
+    CACHE_PINNED_DEPTH = 3
+
     def __init__(self, nav, b):
         # Store the associated navigator
         self._nav = nav
         # The DAWG bytearray
         self._b = b
-        if id(b) in self._iter_caches:
-            # We already have a cache associated with this byte buffer
-            self._iter_cache = self._iter_caches[id(b)]
-        else:
-            # Create a fresh cache for this byte buffer
-            self._iter_cache = self._iter_caches[id(b)] = dict()
+        self._iter_cache, self._coded_cache = self._caches_for(b)
         # If the navigator has a method called accept_resumable(),
         # note it and call it with additional state information instead of
         # plain accept()
         self._resumable = callable(getattr(nav, "accept_resumable", None))
 
+    @classmethod
+    def _caches_for(cls, b):
+        """ Return the plain and coded edge iteration caches for a byte buffer """
+        caches = cls._iter_caches.get(id(b))
+        if caches is None or caches[0].buffer is not b:
+            # Create fresh caches for this byte buffer
+            budget = cls._cache_budget
+            caches = cls._iter_caches[id(b)] = (
+                _EdgeCache(b, budget, cls.CACHE_PINNED_DEPTH),
+                _EdgeCache(b, budget, cls.CACHE_PINNED_DEPTH)
+            )
+        return caches
+
+    @classmethod
+    def release_caches(cls, b):
+        """ Discard the edge iteration caches for a byte buffer that is no longer in use """
+        caches = cls._iter_caches.get(id(b))
+        if caches is not None and caches[0].buffer is b:
+            del cls._iter_caches[id(b)]
+            for cache in caches:
+                cache.clear()
+
     def _iter_from_node(self, offset):
         """ A generator for yielding prefixes and next node offset along an edge
             starting at the given offset in the DAWG bytearray """
-        b = self._b
-        coding = self._CODING
+        return self.iter_edges(self._b, offset)
+
+    @classmethod
+    def iter_edges(cls, b, offset):
+        """ A generator for yielding prefixes and next node offset along an edge
+            starting at the given offset in the packed byte buffer b """
+        coding = cls._CODING
         num_edges = b[offset] & 0x7f
         offset += 1
         for _ in range(num_edges):
@@ -707,28 +1647,102 @@ class PackedNavigation:
                 nextnode = 0
             else:
                 # Read the next node offset
-                nextnode, = self._UINT32.unpack_from(b, offset) # Tuple of length 1, i.e. (n, )
+                nextnode, = cls._UINT32.unpack_from(b, offset) # Tuple of length 1, i.e. (n, )
                 offset += 4
             yield prefix, nextnode
 
-    def _make_iter_from_node(self, offset):
+    @classmethod
+    def iter_coded_edges(cls, b, offset):
+        """ A generator for yielding coded prefixes and next node offsets along
+            an edge starting at the given offset in the packed byte buffer b.
+            A coded prefix is a tuple of letter codes, i.e. indices into
+            Alphabet.order, where the 0x80 bit denotes finality. """
+        num_edges = b[offset] & 0x7f
+        offset += 1
+        for _ in range(num_edges):
+            len_byte = b[offset]
+            offset += 1
+            if len_byte & 0x40:
+                # Single character, with the final bit in the header
+                codes = ((len_byte & 0x3f) | (len_byte & 0x80), )
+            else:
+                len_byte &= 0x3f
+                codes = tuple(b[offset + j] for j in range(len_byte))
+                offset += len_byte
+            if b[offset - 1] & 0x80:
+                # The last character of the prefix had a final marker: nextnode is 0
+                nextnode = 0
+            else:
+                # Read the next node offset
+                nextnode, = cls._UINT32.unpack_from(b, offset) # Tuple of length 1, i.e. (n, )
+                offset += 4
+            yield codes, nextnode
+
+    @classmethod
+    def encode_prefix(cls, prefix):
+        """ Convert a prefix string, eventually containing vertical bars
+            denoting finality, into a coded prefix """
+        codes = cls._prefix_codes.get(prefix)
+        if codes is None:
+            codes = []
+            coding = cls._CODES
+            for c in prefix:
+                if c == u'|':
+                    codes[-1] |= 0x80
+                else:
+                    codes.append(coding[c])
+            codes = tuple(codes)
+            if len(cls._prefix_codes) >= cls.PREFIX_CODES_MAX:
+                cls._prefix_codes.clear()
+            cls._prefix_codes[prefix] = codes
+        return codes
+
+    def _make_iter_from_node(self, offset, depth):
         """ Return an iterator over the prefixes and next node pointers
-            of the edge at the given offset. If this is the first time
-            that the edge is iterated, cache its unpacked contents
-            in a dictionary for quicker subsequent iteration. """
-        try:
-            d = self._iter_cache[offset]
-        except KeyError:
+            of the edge at the given offset. If the edge is not found
+            in the cache, unpack its contents into a dictionary
+            and cache it for quicker subsequent iteration. """
+        cache = self._iter_cache
+        d = cache.lookup(offset)
+        if d is None:
             d = { prefix : nextnode for prefix, nextnode in self._iter_from_node(offset) }
-            self._iter_cache[offset] = d
+            cache.store(offset, depth, d)
         return d.iteritems()
 
+    @classmethod
+    def configure_cache(cls, max_entries = None, pinned_depth = None):
+        """ Set the total budget and pinning depth of edge iteration caches.
+            Existing caches are trimmed to the new budget. """
+        budget = cls._cache_budget
+        if max_entries is not None:
+            cls.CACHE_MAX_ENTRIES = max_entries
+            with budget.lock:
+                budget.max_entries = max_entries
+                budget.trim()
+        if pinned_depth is not None:
+            cls.CACHE_PINNED_DEPTH = pinned_depth
+            for caches in cls._iter_caches.values():
+                for cache in caches:
+                    cache.configure(pinned_depth)
+
+    @classmethod
+    def cache_stats(cls):
+        """ Return aggregated statistics for all edge iteration caches """
+        stats = dict(entries = 0, pinned = 0, hits = 0, misses = 0, evictions = 0)
+        for caches in cls._iter_caches.values():
+            for cache in caches:
+                for key, val in cache.stats().items():
+                    stats[key] += val
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = float(stats["hits"]) / lookups if lookups else 0.0
+        return stats
+
     def _navigate_from_node(self, offset, matched):
         """ Starting from a given node, navigate outgoing edges """
         # Go through the edges of this node and follow the ones
         # okayed by the navigator
         nav = self._nav
-        for prefix, nextnode in self._make_iter_from_node(offset):
+        for prefix, nextnode in self._make_iter_from_node(offset, len(matched)):
             if nav.push_edge(prefix[0]):
                 # This edge is a candidate: navigate through it
                 self._navigate_from_edge(prefix, nextnode, matched)
@@ -780,15 +1794,413 @@ class PackedNavigation:
             # continue with the next node
             self._navigate_from_node(nextnode, matched)
 
+    def _edges(self, node, depth):
+        """ Return an iterator over the (prefix, nextnode) edges of a node """
+        return self._make_iter_from_node(node, depth)
+
+    def _coded_edges(self, node, depth):
+        """ Return a list of the (coded prefix, nextnode) edges of a node """
+        cache = self._coded_cache
+        edges = cache.lookup(node)
+        if edges is None:
+            edges = list(self.iter_coded_edges(self._b, node))
+            cache.store(node, depth, edges)
+        return edges
+
+    def _constraints(self, depth):
+        """ Obtain declarative constraints from the navigator, if it supports them """
+        constraints = getattr(self._nav, "constraints", None)
+        return None if constraints is None else constraints(depth)
+
+    def _navigate_constrained(self, c, edges, matched):
+        """ Navigate iteratively using an explicit stack, under the given
+            constraints, starting with the given coded edges """
+        b = self._b
+        maxlen = c.maxlen
+        allowed = c.allowed
+        ends = c.ends
+        report = c.report
+        rack = c.rack
+        free = c.free
+        letters = Alphabet.order
+        blank = Alphabet.BLANK
+        # The letter codes along the current path, indexed by depth.
+        # The letters already matched are not included.
+        base = len(matched)
+        path = [0] * max(maxlen, base)
+        # Each stack frame contains an iterator over the edges still to be
+        # visited from a node, the depth of the node and a list of the
+        # rack tiles taken along the edge currently being visited
+        stack = [(iter(edges), base, [])]
+        while stack:
+            it, depth0, taken = stack[-1]
+            if taken:
+                # Returning from a child node: put back the rack tiles
+                # taken on the way to it
+                for tile in taken:
+                    rack[tile] += 1
+                del taken[:]
+            # If only a single letter is allowed at this depth, at most one
+            # edge can match and there is no need to look at the others
+            a = allowed[depth0] if depth0 < maxlen else None
+            single = a is not None and not a & (a - 1)
+            descended = False
+            for codes, nextnode in it:
+                lenp = len(codes)
+                j = 0
+                depth = depth0
+                while j < lenp and depth < maxlen:
+                    code = codes[j]
+                    ch = code & 0x7f
+                    a = allowed[depth]
+                    if a is not None and not a & (1 << ch):
+                        break
+                    if rack is not None and not (free and free[depth]):
+                        # Take the letter from the rack, using a blank tile if required
+                        if rack[ch]:
+                            rack[ch] -= 1
+                            taken.append(ch)
+                        elif rack[blank]:
+                            rack[blank] -= 1
+                            taken.append(blank)
+                        else:
+                            break
+                    path[depth] = ch
+                    j += 1
+                    depth += 1
+                    # Check for finality, denoted by the final bit of the letter
+                    # or implicitly at the end of the prefix by the next node
+                    if ends[depth] and (code & 0x80 or (j == lenp and
+                        (nextnode == 0 or b[nextnode] & 0x80))):
+                        # Only now convert the word to a string
+                        report(matched + u''.join([letters[x] for x in path[base:depth]]))
+                if j == lenp and nextnode != 0 and depth < maxlen:
+                    # Completed the edge: continue into the next node
+                    if single:
+                        stack[-1] = (iter(()), depth0, taken)
+                    stack.append((iter(self._coded_edges(nextnode, depth)), depth, []))
+                    descended = True
+                    break
+                if taken:
+                    # Done with this edge: put back the rack tiles taken on it
+                    for tile in taken:
+                        rack[tile] += 1
+                    del taken[:]
+                if single and codes and 1 << (codes[0] & 0x7f) == allowed[depth0]:
+                    break
+            if not descended:
+                # All edges of this node have been visited
+                stack.pop()
+
+    def navigate_gaddag(self, c):
+        """ Navigate a GADDAG iteratively using an explicit stack, generating
+            the words through an anchor square described by the constraints """
+        b = self._b
+        sep = GADDAG_SEPARATOR_CODE
+        left_allowed = c.left_allowed
+        left_free = c.left_free
+        left_turn = c.left_turn
+        right_allowed = c.right_allowed
+        right_free = c.right_free
+        right_ends = c.right_ends
+        rack = c.rack
+        report = c.report
+        maxleft = len(left_allowed)
+        maxright = len(right_allowed)
+        letters = Alphabet.order
+        blank = Alphabet.BLANK
+        # The letter codes placed on the left, starting with the anchor,
+        # and on the right of the anchor
+        left = [0] * maxleft
+        right = [0] * maxright
+        # Each stack frame contains an iterator over the edges still to be
+        # visited from a node, the number of letters placed on the left and
+        # on the right at the node (-1 if still going left), and a list of
+        # the rack tiles taken along the edge currently being visited
+        stack = [(iter(self._coded_edges(0, 0)), 0, -1, [])]
+        while stack:
+            it, d0, k0, taken = stack[-1]
+            if taken:
+                # Returning from a child node: put back the rack tiles
+                # taken on the way to it
+                for tile in taken:
+                    rack[tile] += 1
+                del taken[:]
+            descended = False
+            for codes, nextnode in it:
+                lenp = len(codes)
+                j = 0
+                d = d0
+                k = k0
+                while j < lenp:
+                    code = codes[j]
+                    ch = code & 0x7f
+                    if k < 0:
+                        # Going left from the anchor
+                        if ch == sep:
+                            # Turn around, if the word can start here
+                            if not left_turn[d]:
+                                break
+                            k = 0
+                        elif d >= maxleft or not left_allowed[d] & (1 << ch):
+                            break
+                        else:
+                            if not left_free[d]:
+                                # Take the letter from the rack, using a blank tile if required
+                                if rack[ch]:
+                                    rack[ch] -= 1
+                                    taken.append(ch)
+                                elif rack[blank]:
+                                    rack[blank] -= 1
+                                    taken.append(blank)
+                                else:
+                                    break
+                            left[d] = ch
+                            d += 1
+                    else:
+                        # Going right from the anchor
+                        if k >= maxright or not right_allowed[k] & (1 << ch):
+                            break
+                        if not right_free[k]:
+                            if rack[ch]:
+                                rack[ch] -= 1
+                                taken.append(ch)
+                            elif rack[blank]:
+                                rack[blank] -= 1
+                                taken.append(blank)
+                            else:
+                                break
+                        right[k] = ch
+                        k += 1
+                    j += 1
+                    # Words can only be completed after the separator
+                    if k >= 0 and right_ends[k] and d + k > 1 and (code & 0x80 or (j == lenp and
+                        (nextnode == 0 or b[nextnode] & 0x80))):
+                        report(u''.join([letters[x] for x in reversed(left[:d])]) +
+                            u''.join([letters[x] for x in right[:k]]), d)
+                if j == lenp and nextnode != 0 and (k < maxright if k >= 0 else
+                    (d < maxleft or left_turn[d])):
+                    # Completed the edge: continue into the next node
+                    stack.append((iter(self._coded_edges(nextnode, d + k + 1)), d, k, []))
+                    descended = True
+                    break
+                if taken:
+                    # Done with this edge: put back the rack tiles taken on it
+                    for tile in taken:
+                        rack[tile] += 1
+                    del taken[:]
+            if not descended:
+                # All edges of this node have been visited
+                stack.pop()
+
+    def find_many(self, words):
+        """ Look up a batch of words, sharing the traversal of common prefixes """
+        b = self._b
+        return _find_many(words, 0, self._edges,
+            lambda nextnode: nextnode == 0 or b[nextnode] & 0x80, 0)
+
+    def crosscheck_bits(self, above, below):
+        """ Return a bit pattern of the letters that fit between above and below """
+        b = self._b
+        return _crosscheck_bits(above, below, 0, self._edges,
+            lambda nextnode: nextnode == 0 or b[nextnode] & 0x80, 0)
+
     def go(self):
         """ Perform the navigation using the given navigator """
+        c = self._constraints(0)
+        if c is not None:
+            self._navigate_constrained(c, self._coded_edges(0, 0), u'')
         # The ship is ready to go
-        if self._nav.accepting():
+        elif self._nav.accepting():
             # Leave shore and navigate the open seas
             self._navigate_from_node(0, u'')
         self._nav.done()
 
     def resume(self, prefix, nextnode, matched):
         """ Resume navigation from a previously saved state """
-        self._navigate_from_edge(prefix, nextnode, matched)
+        c = self._constraints(len(matched))
+        if c is not None:
+            self._navigate_constrained(c, ((self.encode_prefix(prefix), nextnode),), matched)
+        else:
+            self._navigate_from_edge(prefix, nextnode, matched)
+
+
+
+class _EdgeCache:
+
+    """ A bounded cache of unpacked node edges for a packed byte buffer,
+        keyed by node offset. Nodes in the upper levels of the graph are
+        pinned and never evicted. Other nodes are kept within a budget of
+        entries that is shared by all caches (see _CacheBudget). Lookups
+        do not lock; updates of unpinned entries are serialized by the
+        lock of the budget. The hit and miss counters are not synchronized
+        between threads and are thus approximate. """
+
+    def __init__(self, buffer, budget, pinned_depth):
+        # Keep a reference to the buffer so that its id is not reused
+        # for another buffer while this cache exists
+        self.buffer = buffer
+        self._budget = budget
+        self._pinned_depth = pinned_depth
+        self._pinned = dict()
+        self._entries = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, pinned_depth):
+        """ Modify the pinning depth, which applies to subsequently stored entries """
+        self._pinned_depth = pinned_depth
+
+    def evict(self, offset):
+        """ Evict an unpinned entry. Called by the budget with its lock held. """
+        del self._entries[offset]
+        self.evictions += 1
+
+    def clear(self):
+        """ Remove all entries, returning their share of the budget """
+        budget = self._budget
+        with budget.lock:
+            budget.remove(self)
+            self._entries = dict()
+            self._pinned = dict()
+
+    def lookup(self, offset):
+        """ Return the cached edges of the node at the offset, or None if not found """
+        d = self._pinned.get(offset)
+        if d is None:
+            d = self._entries.get(offset)
+            if d is None:
+                self.misses += 1
+                return None
+        self.hits += 1
+        return d
+
+    def store(self, offset, depth, d):
+        """ Store the edges of the node at the offset, reached at the given depth """
+        if depth < self._pinned_depth:
+            self._pinned[offset] = d
+        else:
+            budget = self._budget
+            with budget.lock:
+                if offset not in self._entries:
+                    self._entries[offset] = d
+                    budget.add(self, offset)
+
+    def stats(self):
+        """ Return a dict of cache statistics """
+        return dict(
+            entries = len(self._pinned) + len(self._entries),
+            pinned = len(self._pinned),
+            hits = self.hits,
+            misses = self.misses,
+            evictions = self.evictions
+        )
+
+
+class _DawgTable:
+
+    """ A DAWG compiled from a packed byte buffer into flat, parallel
+        tables of nodes and edges, indexed by integers. The root is node 0.
+
+        The outgoing edges of node i are numbered from node_edges[i] up to
+        but not including node_edges[i + 1]. Edge e has the prefix string
+        edge_prefix[e], with embedded vertical bars denoting finality as
+        in the text format, and leads to node edge_next[e], where 0 means
+        that the edge ends in a final letter with no outgoing edges.
+        edge_codes[e] is the same prefix coded as a tuple of letter codes
+        (see PackedNavigation.iter_coded_edges).
+        node_final[i] has the same final bit (0x80) as the packed node header.
+    """
+
+    def __init__(self, b):
+        self.node_edges = array('l')
+        self.node_final = bytearray()
+        self.edge_prefix = []
+        self.edge_codes = []
+        self.edge_next = array('l')
+        # Map of packed buffer offsets to node indices
+        index = { 0 : 0 }
+        offsets = [0]
+        # Identical prefix strings are shared between edges to save memory
+        prefixes = dict()
+        i = 0
+        while i < len(offsets):
+            offset = offsets[i]
+            self.node_edges.append(len(self.edge_prefix))
+            # The root header contains only an edge count, without a final bit
+            self.node_final.append(b[offset] & 0x80 if i else 0x00)
+            coded = PackedNavigation.iter_coded_edges(b, offset)
+            for prefix, nextnode in PackedNavigation.iter_edges(b, offset):
+                codes, _ = next(coded)
+                self.edge_prefix.append(prefixes.setdefault(prefix, prefix))
+                self.edge_codes.append(prefixes.setdefault(codes, codes))
+                if nextnode != 0:
+                    ix = index.get(nextnode)
+                    if ix is None:
+                        # First time we see this node: assign it the next index
+                        ix = index[nextnode] = len(offsets)
+                        offsets.append(nextnode)
+                    nextnode = ix
+                self.edge_next.append(nextnode)
+            i += 1
+        # Sentinel for the edge range of the last node
+        self.node_edges.append(len(self.edge_prefix))
+
+    def num_nodes(self):
+        """ Return the number of nodes in the table, including the root """
+        return len(self.node_edges) - 1
 
+    def num_edges(self):
+        """ Return the number of edges in the table """
+        return len(self.edge_prefix)
+
+
+class CompiledNavigation(PackedNavigation):
+
+    """ Manages the state for a navigation over a compiled DAWG table.
+        Nodes are integer indices into the table, so there is no
+        decoding of the packed buffer or caching of edge dictionaries
+        during navigation. """
+
+    # noinspection PyMissingConstructor
+    def __init__(self, nav, table):
+        # Store the associated navigator
+        self._nav = nav
+        self._table = table
+        # The node final flags take the place of the byte buffer
+        # when checking for finality at the end of an edge
+        self._b = table.node_final
+        # If the navigator has a method called accept_resumable(),
+        # note it and call it with additional state information instead of
+        # plain accept()
+        self._resumable = callable(getattr(nav, "accept_resumable", None))
+
+    def _edges(self, node, depth):
+        """ Return an iterator over the (prefix, nextnode) edges of a node """
+        table = self._table
+        first, last = table.node_edges[node], table.node_edges[node + 1]
+        return izip(table.edge_prefix[first : last], table.edge_next[first : last])
+
+    def _coded_edges(self, node, depth):
+        """ Return an iterator over the (coded prefix, nextnode) edges of a node """
+        table = self._table
+        first, last = table.node_edges[node], table.node_edges[node + 1]
+        return izip(table.edge_codes[first : last], table.edge_next[first : last])
+
+    def _navigate_from_node(self, node, matched):
+        """ Starting from a given node, navigate outgoing edges """
+        # Go through the edges of this node and follow the ones
+        # okayed by the navigator
+        nav = self._nav
+        table = self._table
+        edge_prefix = table.edge_prefix
+        edge_next = table.edge_next
+        for e in xrange(table.node_edges[node], table.node_edges[node + 1]):
+            prefix = edge_prefix[e]
+            if nav.push_edge(prefix[0]):
+                # This edge is a candidate: navigate through it
+                self._navigate_from_edge(prefix, edge_next[e], matched)
+                if not nav.pop_edge():
+                    # Short-circuit and finish the loop if pop_edge() returns False
+                    break
@@ -38,6 +38,11 @@ class Alphabet:
 
     # Map letters to bits
     letter_bit = { letter : 1 << ix for ix, letter in enumerate(order) }
+    # Map tiles to their integer codes, i.e. indices into all_tiles.
+    # The codes of letters are the same as in the packed DAWG format.
+    tile_index = { tile : ix for ix, tile in enumerate(all_tiles) }
+    # The integer code of the blank tile
+    BLANK = len(order)
 
     # Locale collation (sorting) map, initialized in _init()
     _lcmap = None # Case sensitive
@@ -48,6 +53,17 @@ class Alphabet:
         """ Return a pattern of bits indicating which letters are present in the word """
         return reduce(lambda x, y: x | y, [Alphabet.letter_bit[c] for c in word], 0)
 
+    @staticmethod
+    def tile_counts(tiles):
+        """ Return a list of tile counts for a string of tiles, indexed by tile code """
+        counts = [0] * len(Alphabet.all_tiles)
+        tile_index = Alphabet.tile_index
+        for tile in tiles:
+            ix = tile_index.get(tile)
+            if ix is not None:
+                counts[ix] += 1
+        return counts
+
     @staticmethod
     def bit_of(c):
         """ Returns the bit corresponding to a character in the alphabet """
@@ -76,6 +76,13 @@ with open(os.path.abspath(os.path.join("resources", "secret_key.bin")), "rb") as
 # within an instance
 _autoplayer_lock = threading.Lock()
 
+# Start loading the word databases in the background as soon as the
+# instance starts. Handlers that need them wait on readiness for at most
+# this many seconds; after that, the databases are loaded on first use.
+# The GADDAG is only warmed up if a robot level generates moves from it.
+Wordbase.start_warmup(gaddags = bool(AutoPlayer.GADDAG_LEVELS))
+_WARMUP_TIMEOUT = 30.0
+
 # Promotion parameters
 _PROMO_FREQUENCY = 8 # A promo check is done randomly, but on average every 1 out of N times
 _PROMO_COUNT = 2 # Max number of times that the same promo is displayed
@@ -237,6 +244,10 @@ def _process_move(game, movelist):
         # show the user a corresponding error message
         return jsonify(result = err, msg = msg)
 
+    # Make sure the dictionaries are loaded before entering the
+    # serialized section, in case the autoplayer needs to move
+    Wordbase.wait_ready(_WARMUP_TIMEOUT)
+
     # Serialize access to the following code section
     with _autoplayer_lock:
 
@@ -774,8 +785,10 @@ def _challengelist():
 def start():
     """ App Engine is starting a fresh instance - warm it up by loading word database """
 
-    wdb = Wordbase.dawg()
-    ok = u"upphitun" in wdb # Use a random word to check ('upphitun' means warm-up)
+    ok = Wordbase.wait_ready(_WARMUP_TIMEOUT)
+    if ok:
+        wdb = Wordbase.dawg()
+        ok = u"upphitun" in wdb # Use a random word to check ('upphitun' means warm-up)
     logging.info(u"Start/warmup, instance {0}, ok is {1}".format(
         os.environ.get("INSTANCE_ID", ""), ok))
     return "", 200 # jsonify(ok = ok)
@@ -912,8 +925,9 @@ def wordcheck():
     word = rq["word"]
 
     # Check the words against the dictionary
+    Wordbase.wait_ready(_WARMUP_TIMEOUT)
     wdb = Wordbase.dawg()
-    ok = all([w in wdb for w in words])
+    ok = all(wdb.find_many(words))
     return jsonify(word = word, ok = ok)
 
 
@@ -1326,6 +1340,8 @@ def review():
     best_moves = None
     if game.allows_best_moves():
 
+        Wordbase.wait_ready(_WARMUP_TIMEOUT)
+
         # Serialize access to the following section
         with _autoplayer_lock:
 
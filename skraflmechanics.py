@@ -23,8 +23,10 @@
 """
 
 import logging
+import threading
 
 from random import SystemRandom
+from collections import OrderedDict
 
 from dawgdictionary import Wordbase
 from languages import Alphabet
@@ -85,8 +87,9 @@ class Board:
     # The rows are identified by letter
     ROWIDS = u"ABCDEFGHIJKLMNO"
 
-    _wordscore = [ [ int(c) for c in row ] for row in _RAW_WORDSCORE ]
-    _letterscore = [ [ int(c) for c in row ] for row in _RAW_LETTERSCORE ]
+    # Score multipliers in flat lists, indexed by row * SIZE + col
+    _wordscore = [ int(c) for row in _RAW_WORDSCORE for c in row ]
+    _letterscore = [ int(c) for row in _RAW_LETTERSCORE for c in row ]
 
     @staticmethod
     def short_coordinate(horiz, row, col):
@@ -96,10 +99,14 @@ class Board:
     def __init__(self, copy = None):
 
         if copy is None:
-            # Store letters on the board in list of strings
-            self._letters = [u' ' * Board.SIZE for _ in range(Board.SIZE)]
-            # Store tiles on the board in list of strings
-            self._tiles = [u' ' * Board.SIZE for _ in range(Board.SIZE)]
+            # Store letters on the board in a flat list, indexed by row * SIZE + col
+            self._letters = [u' '] * (Board.SIZE * Board.SIZE)
+            # Store tiles on the board in a flat list, indexed in the same way
+            self._tiles = [u' '] * (Board.SIZE * Board.SIZE)
+            # Occupancy bit patterns of the covered squares: bit row * SIZE + col
+            # is set in _occupied and bit col * SIZE + row in the transposed one
+            self._occupied = 0
+            self._occupied_t = 0
             # The two counts below should always stay in sync
             self._numletters = 0
             self._numtiles = 0
@@ -107,6 +114,8 @@ class Board:
             # Copy constructor: initialize from another Board
             self._letters = copy._letters[:]
             self._tiles = copy._tiles[:]
+            self._occupied = copy._occupied
+            self._occupied_t = copy._occupied_t
             self._numletters = copy._numletters
             self._numtiles = copy._numtiles
 
@@ -117,50 +126,62 @@ class Board:
 
     def is_covered(self, row, col):
         """ Is the specified square already covered (taken)? """
-        return self._letters[row][col] != u' '
+        return self._letters[row * Board.SIZE + col] != u' '
 
     def has_adjacent(self, row, col):
         """ Check whether there are any tiles on the board adjacent to this square """
-        if row > 0 and self.is_covered(row - 1, col):
-            return True
-        if row < Board.SIZE - 1 and self.is_covered(row + 1, col):
-            return True
-        if col > 0 and self.is_covered(row, col - 1):
-            return True
-        if col < Board.SIZE - 1 and self.is_covered(row, col + 1):
-            return True
-        return False
+        return bool(self._occupied & Board._NEIGHBOURS[row * Board.SIZE + col])
+
+    def occupied_bits(self, index, horizontal):
+        """ Return a bit pattern of the covered squares within a row (if horizontal)
+            or column, where bit i corresponds to the square at index i """
+        occupied = self._occupied if horizontal else self._occupied_t
+        return (occupied >> (index * Board.SIZE)) & Board._LINE_MASK
+
+    def anchor_bits(self):
+        """ Return a bit pattern of the empty squares that are adjacent to covered
+            squares, where bit row * SIZE + col corresponds to the square (row, col) """
+        occ = self._occupied
+        size = Board.SIZE
+        adjacent = ((occ >> size) | (occ << size) |
+            ((occ >> 1) & Board._NOT_LAST_COL) | ((occ << 1) & Board._NOT_FIRST_COL))
+        return adjacent & ~occ & Board._FULL_MASK
 
     def letter_at(self, row, col):
         """ Return the letter at the specified co-ordinate """
-        return self._letters[row][col]
+        return self._letters[row * Board.SIZE + col]
 
     def tile_at(self, row, col):
         """ Return the tile at the specified co-ordinate (may be '?' for blank tile) """
-        return self._tiles[row][col]
+        return self._tiles[row * Board.SIZE + col]
 
     def set_letter(self, row, col, letter):
         """ Set the letter at the specified co-ordinate """
         # assert letter is not None
         # assert len(letter) == 1
-        prev = self._letters[row][col]
+        ix = row * Board.SIZE + col
+        prev = self._letters[ix]
         if prev == letter:
             # Unchanged square: we're done
             return
         if prev == u' ' and letter != u' ':
             # Putting a letter into a previously empty square
             self._numletters += 1
+            self._occupied |= 1 << ix
+            self._occupied_t |= 1 << (col * Board.SIZE + row)
         elif prev != u' ' and letter == u' ':
             # Removing a letter from a previously filled square
             self._numletters -= 1
-        r = self._letters[row]
-        self._letters[row] = r[0:col] + letter + r[col + 1:]
+            self._occupied &= ~(1 << ix)
+            self._occupied_t &= ~(1 << (col * Board.SIZE + row))
+        self._letters[ix] = letter
 
     def set_tile(self, row, col, tile):
         """ Set the tile at the specified co-ordinate """
         # assert tile is not None
         # assert len(tile) == 1
-        prev = self._tiles[row][col]
+        ix = row * Board.SIZE + col
+        prev = self._tiles[ix]
         if prev == tile:
             # Unchanged square: we're done
             return
@@ -170,16 +191,14 @@ class Board:
         elif prev != u' ' and tile == u' ':
             # Removing a tile from a previously filled square
             self._numtiles -= 1
-        r = self._tiles[row]
-        self._tiles[row] = r[0:col] + tile + r[col + 1:]
+        self._tiles[ix] = tile
 
     def enum_tiles(self):
         """ Enumerate the tiles on the board with their coordinates """
-        for x in range(Board.SIZE):
-            for y in range(Board.SIZE):
-                t = self.tile_at(x, y)
-                if t != u' ':
-                    yield (x, y, t, self.letter_at(x,y))
+        size = Board.SIZE
+        for ix, t in enumerate(self._tiles):
+            if t != u' ':
+                yield (ix // size, ix % size, t, self._letters[ix])
 
     @staticmethod
     def adjacent(row, col, xd, yd, getter):
@@ -187,7 +206,8 @@ class Board:
         result = u''
         row += xd
         col += yd
-        while row in range(Board.SIZE) and col in range(Board.SIZE):
+        size = Board.SIZE
+        while 0 <= row < size and 0 <= col < size:
             ltr = getter(row, col)
             if ltr == u' ':
                 # Empty square: we're done
@@ -202,42 +222,61 @@ class Board:
             col += yd
         return result
 
+    @staticmethod
+    def _run(squares, ix, step, count):
+        """ Return the contents of up to count consecutive covered squares,
+            starting next to the flat index ix and proceeding by step """
+        result = []
+        for _ in range(count):
+            ix += step
+            ltr = squares[ix]
+            if ltr == u' ':
+                # Empty square: we're done
+                break
+            result.append(ltr)
+        if step < 0:
+            # Going up or to the left: the run was collected backwards
+            result.reverse()
+        return u''.join(result)
+
     def letters_above(self, row, col):
         """ Return the letters immediately above the given square, if any """
-        return self.adjacent(row, col, -1, 0, self.letter_at)
+        return self._run(self._letters, row * Board.SIZE + col, -Board.SIZE, row)
 
     def letters_below(self, row, col):
         """ Return the letters immediately below the given square, if any """
-        return self.adjacent(row, col, 1, 0, self.letter_at)
+        return self._run(self._letters, row * Board.SIZE + col, Board.SIZE, Board.SIZE - 1 - row)
 
     def letters_left(self, row, col):
         """ Return the letters immediately to the left of the given square, if any """
-        return self.adjacent(row, col, 0, -1, self.letter_at)
+        return self._run(self._letters, row * Board.SIZE + col, -1, col)
 
     def letters_right(self, row, col):
         """ Return the letters immediately to the right of the given square, if any """
-        return self.adjacent(row, col, 0, 1, self.letter_at)
+        return self._run(self._letters, row * Board.SIZE + col, 1, Board.SIZE - 1 - col)
 
     def tiles_above(self, row, col):
         """ Return the tiles immediately above the given square, if any """
-        return self.adjacent(row, col, -1, 0, self.tile_at)
+        return self._run(self._tiles, row * Board.SIZE + col, -Board.SIZE, row)
 
     def tiles_below(self, row, col):
         """ Return the tiles immediately below the given square, if any """
-        return self.adjacent(row, col, 1, 0, self.tile_at)
+        return self._run(self._tiles, row * Board.SIZE + col, Board.SIZE, Board.SIZE - 1 - row)
 
     def tiles_left(self, row, col):
         """ Return the tiles immediately to the left of the given square, if any """
-        return self.adjacent(row, col, 0, -1, self.tile_at)
+        return self._run(self._tiles, row * Board.SIZE + col, -1, col)
 
     def tiles_right(self, row, col):
         """ Return the tiles immediately to the right of the given square, if any """
-        return self.adjacent(row, col, 0, 1, self.tile_at)
+        return self._run(self._tiles, row * Board.SIZE + col, 1, Board.SIZE - 1 - col)
 
     def __str__(self):
         """ Simple text dump of the contents of the board """
         l = [u"   1 2 3 4 5 6 7 8 9 0 1 2 3 4 5"]
-        for y, row in enumerate(self._letters):
+        size = Board.SIZE
+        for y in range(size):
+            row = self._letters[y * size : (y + 1) * size]
             l.append(Board.ROWIDS[y] + u': ' + \
                 u' '.join([u'.' if c == u' ' else c for c in row]))
         return u'\n'.join(l)
@@ -245,65 +284,311 @@ class Board:
     @staticmethod
     def wordscore(row, col):
         """ Returns the word score factor of the indicated square, 1, 2 or 3 """
-        return Board._wordscore[row][col]
+        return Board._wordscore[row * Board.SIZE + col]
 
     @staticmethod
     def letterscore(row, col):
         """ Returns the letter score factor of the indicated square, 1, 2 or 3 """
-        return Board._letterscore[row][col]
+        return Board._letterscore[row * Board.SIZE + col]
+
+
+# Bit pattern masks for board occupancy, where bit row * SIZE + col
+# corresponds to the square (row, col)
+Board._LINE_MASK = (1 << Board.SIZE) - 1
+Board._FULL_MASK = (1 << (Board.SIZE * Board.SIZE)) - 1
+Board._NOT_FIRST_COL = Board._FULL_MASK & ~sum(1 << (row * Board.SIZE) for row in range(Board.SIZE))
+Board._NOT_LAST_COL = Board._FULL_MASK & ~sum(1 << (row * Board.SIZE + Board.SIZE - 1) for row in range(Board.SIZE))
+# The squares adjacent to each square
+Board._NEIGHBOURS = [
+    ((1 << (ix - Board.SIZE)) if ix >= Board.SIZE else 0) |
+    ((1 << (ix + Board.SIZE)) if ix < Board.SIZE * (Board.SIZE - 1) else 0) |
+    ((1 << (ix - 1)) if ix % Board.SIZE > 0 else 0) |
+    ((1 << (ix + 1)) if ix % Board.SIZE < Board.SIZE - 1 else 0)
+    for ix in range(Board.SIZE * Board.SIZE)
+]
+
+
+class CrossCheckCache:
+
+    """ A process-wide, bounded LRU cache of cross-check bit patterns,
+        keyed by the word fragments above and below (or left and right of)
+        an empty square. The cached bit pattern contains all letters that
+        form a valid cross word when placed between the fragments, regardless
+        of the rack. The cache is shared by all AutoPlayer instances, since
+        the same fragment pairs recur constantly across moves and games.
+    """
+
+    MAX_ENTRIES = 20000
+
+    _lock = threading.Lock()
+    _entries = OrderedDict()
+    # The DAWG for which the cached entries are valid
+    _dawg = None
+    _hits = 0
+    _misses = 0
+    _evictions = 0
+
+    @classmethod
+    def lookup(cls, dawg, above, below):
+        """ Return the bit pattern of letters that fit between the above
+            and below fragments, querying the DAWG only on a cache miss """
+        key = (above, below)
+        with cls._lock:
+            if dawg is not cls._dawg:
+                # The dictionary has changed: the cached entries are stale
+                cls._entries.clear()
+                cls._dawg = dawg
+            bits = cls._entries.pop(key, None)
+            if bits is not None:
+                # Re-insert to mark the entry as the most recently used one
+                cls._entries[key] = bits
+                cls._hits += 1
+                return bits
+            cls._misses += 1
+        # Query the DAWG outside the lock
+        bits = dawg.crosscheck_bits(above, below)
+        with cls._lock:
+            if dawg is cls._dawg:
+                entries = cls._entries
+                entries[key] = bits
+                while len(entries) > cls.MAX_ENTRIES:
+                    # Evict the least recently used entry
+                    entries.popitem(last = False)
+                    cls._evictions += 1
+        return bits
+
+    @classmethod
+    def clear(cls):
+        """ Remove all entries from the cache """
+        with cls._lock:
+            cls._entries.clear()
+
+    @classmethod
+    def stats(cls):
+        """ Return a dict of cache statistics """
+        with cls._lock:
+            lookups = cls._hits + cls._misses
+            return dict(
+                entries = len(cls._entries),
+                hits = cls._hits,
+                misses = cls._misses,
+                evictions = cls._evictions,
+                hit_rate = float(cls._hits) / lookups if lookups else 0.0
+            )
+
+
+class CrossChecks:
+
+    """ The cross-checks and anchors of all squares on a board, maintained
+        incrementally as tiles are placed on or removed from the board.
+
+        The cross-check of an empty square for a direction of play is a bit
+        pattern of the letters that form valid cross words with the tiles
+        perpendicular to that direction, regardless of any rack. A square with
+        no perpendicular neighbours allows all letters. An anchor is an empty
+        square that is adjacent to a covered square.
+
+        For each empty square and direction of play, the summed scores of the
+        perpendicular tiles are also kept, i.e. the base score of the cross
+        word that a tile placed in the square would join, or None if there
+        are no perpendicular tiles.
+    """
+
+    def __init__(self, board = None, scores = None, copy = None):
+
+        if copy is None:
+            self._dawg = Wordbase.dawg()
+            # The tile scores of the game's tile set
+            self._scores = scores
+            all_bits = Alphabet.all_bits_set()
+            num_squares = Board.SIZE * Board.SIZE
+            # Cross-checks for horizontal moves (constrained by the tiles above
+            # and below) and for vertical moves (constrained by the tiles to the
+            # left and right), indexed by row * Board.SIZE + col
+            self._cc = [[all_bits] * num_squares, [all_bits] * num_squares]
+            # Cross-word base scores, indexed in the same way
+            self._xs = [[None] * num_squares, [None] * num_squares]
+            # Bit pattern of the anchor squares, as in Board.anchor_bits()
+            self._anchors = board.anchor_bits()
+            if not board.is_empty():
+                self._update(board, [(row, col)
+                    for row in range(Board.SIZE) for col in range(Board.SIZE)])
+        else:
+            # Copy constructor
+            self._dawg = copy._dawg
+            self._scores = copy._scores
+            self._cc = [copy._cc[0][:], copy._cc[1][:]]
+            self._xs = [copy._xs[0][:], copy._xs[1][:]]
+            self._anchors = copy._anchors
+
+    def __getstate__(self):
+        """ Pickle the cross-checks without the dictionary object """
+        return (self._cc, self._xs, self._anchors, self._scores)
+
+    def __setstate__(self, state):
+        """ Unpickle the cross-checks, which refer to the main dictionary """
+        self._cc, self._xs, self._anchors, self._scores = state
+        self._dawg = Wordbase.dawg()
+
+    def is_valid(self):
+        """ Returns False if the dictionary has been swapped out since the
+            cross-checks were calculated, so that they must be recalculated """
+        return self._dawg is Wordbase.dawg()
+
+    def crosscheck(self, row, col, horizontal):
+        """ Return the cross-check bit pattern of an empty square,
+            for a move in the given direction """
+        return self._cc[0 if horizontal else 1][row * Board.SIZE + col]
+
+    def cross_score(self, row, col, horizontal):
+        """ Return the summed scores of the tiles in the cross word that a tile
+            placed in the empty square would join, for a move in the given
+            direction, or None if it would not form a cross word """
+        return self._xs[0 if horizontal else 1][row * Board.SIZE + col]
+
+    def is_anchor(self, row, col):
+        """ Is the square an anchor, i.e. empty and adjacent to a covered square? """
+        return bool((self._anchors >> (row * Board.SIZE + col)) & 1)
+
+    def _update(self, board, squares):
+        """ Recalculate the cross-checks and cross-word scores of the given squares """
+        dawg = self._dawg
+        scores = self._scores
+        all_bits = Alphabet.all_bits_set()
+        cc_h, cc_v = self._cc
+        xs_h, xs_v = self._xs
+        for row, col in squares:
+            ix = row * Board.SIZE + col
+            if board.is_covered(row, col):
+                continue
+            above = board.letters_above(row, col)
+            below = board.letters_below(row, col)
+            if above or below:
+                cc_h[ix] = CrossCheckCache.lookup(dawg, above, below)
+                xs_h[ix] = sum(scores[tile] for tile in
+                    board.tiles_above(row, col) + board.tiles_below(row, col))
+            else:
+                cc_h[ix] = all_bits
+                xs_h[ix] = None
+            left = board.letters_left(row, col)
+            right = board.letters_right(row, col)
+            if left or right:
+                cc_v[ix] = CrossCheckCache.lookup(dawg, left, right)
+                xs_v[ix] = sum(scores[tile] for tile in
+                    board.tiles_left(row, col) + board.tiles_right(row, col))
+            else:
+                cc_v[ix] = all_bits
+                xs_v[ix] = None
+
+    def changed(self, board, squares):
+        """ Update the cross-checks and anchors after tiles have been placed on
+            or removed from the given squares, as (row, col) tuples """
+        affected = set(squares)
+        size = Board.SIZE
+        for row, col in squares:
+            # The cross words of the nearest empty square in each direction,
+            # past any covered squares, may have changed
+            for xd, yd in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                x, y = row + xd, col + yd
+                while 0 <= x < size and 0 <= y < size and board.is_covered(x, y):
+                    x += xd
+                    y += yd
+                if 0 <= x < size and 0 <= y < size:
+                    affected.add((x, y))
+        self._update(board, affected)
+        # The anchors are cheaply recalculated for the whole board at once
+        self._anchors = board.anchor_bits()
+
 
-        
 class Bag:
 
-    """ Represents a bag of tiles """
+    """ Represents a bag of tiles, as a list of tile counts indexed by
+        tile code, i.e. by position in Alphabet.all_tiles """
 
     # The sort order for displaying the bag, with blank tiles last
     SORT_ORDER = Alphabet.order + u'?'
-    # The random number generator to use to draw tiles
+    # The default random number generator to use to draw tiles. This is a
+    # cryptographic source, as required for live games. Simulations and tests
+    # can give a bag a faster one, such as a seeded random.Random instance.
     RNG = SystemRandom()
 
-    def __init__(self, tileset, copy = None, debug = False):
+    def __init__(self, tileset, copy = None, debug = False, rng = None):
 
         if copy is None:
             # Get a full bag from the requested tile set
             if debug:
                 # Small bag for debugging endgame cases
-                self._tiles = u"aaábdðefgiiíklmnnóprrsstuuúæ"
+                tiles = u"aaábdðefgiiíklmnnóprrsstuuúæ"
             else:
-                self._tiles = tileset.full_bag()
-            self._size = len(self._tiles)
+                tiles = tileset.full_bag()
+            self._counts = Alphabet.tile_counts(tiles)
+            self._num = sum(self._counts)
+            self._size = self._num
+            # The random number generator of this bag, or None to use Bag.RNG
+            self._rng = rng
         else:
             # Copy constructor: initialize from another Bag
-            self._tiles = copy._tiles
+            self._counts = copy._counts[:]
+            self._num = copy._num
             self._size = copy._size
+            self._rng = copy._rng if rng is None else rng
+
+    def set_rng(self, rng):
+        """ Set the random number generator to draw tiles with, or None for the default """
+        self._rng = rng
+
+    def rng(self):
+        """ Return the random number generator of this bag, or None for the default """
+        return self._rng
+
+    def checkpoint(self):
+        """ Return a record of the current contents of the bag, for restore() """
+        return (self._counts[:], self._num)
+
+    def restore(self, checkpoint):
+        """ Restore the contents of the bag from a record made by checkpoint() """
+        counts, self._num = checkpoint
+        self._counts[:] = counts
 
     def draw_tile(self):
         """ Draw a single tile from the bag """
         if self.is_empty():
             return None
-        tile = self._tiles[Bag.RNG.randint(0, len(self._tiles) - 1)]
-        self._tiles = self._tiles.replace(tile, u'', 1)
-        return tile
+        # Find the tile at a random position within the bag
+        pos = (self._rng or Bag.RNG).randint(0, self._num - 1)
+        counts = self._counts
+        ix = 0
+        while pos >= counts[ix]:
+            pos -= counts[ix]
+            ix += 1
+        counts[ix] -= 1
+        self._num -= 1
+        return Alphabet.all_tiles[ix]
 
     def return_tiles(self, tiles):
         """ Return one or more tiles to the bag """
-        self._tiles += tiles
+        counts = self._counts
+        tile_index = Alphabet.tile_index
+        for tile in tiles:
+            counts[tile_index[tile]] += 1
+        self._num += len(tiles)
 
     def contents(self):
-        """ Return the contents of the bag """
-        return self._tiles
+        """ Return the contents of the bag, in alphabetical order with blank tiles last """
+        return u''.join(tile * n for tile, n in zip(Alphabet.all_tiles, self._counts) if n)
 
     def set_contents(self, tiles):
         """ Set the contents of the bag """
-        self._tiles = tiles
+        self._counts = Alphabet.tile_counts(tiles)
+        self._num = sum(self._counts)
 
     def num_tiles(self):
         """ Return the number of tiles in the bag """
-        return len(self._tiles)
+        return self._num
 
     def is_empty(self):
         """ Returns True if the bag is empty, i.e. all tiles have been drawn """
-        return not self._tiles
+        return self._num == 0
 
     def is_full(self):
         """ Returns True if the bag is full, i.e. no tiles have been drawn """
@@ -313,50 +598,89 @@ class Bag:
         """ Does the bag contain enough tiles to allow exchange? """
         return self.num_tiles() >= Rack.MAX_TILES
 
+    def _subtract(self, tiles):
+        """ Subtract the given tiles from the bag, ignoring any that are not in it """
+        counts = self._counts
+        tile_index = Alphabet.tile_index
+        for tile in tiles:
+            ix = tile_index.get(tile)
+            if ix is not None and counts[ix] > 0:
+                counts[ix] -= 1
+                self._num -= 1
+
     def subtract_board(self, board):
         """ Subtract all tiles on the board from the bag """
-        board_tiles = u''.join(tile for row, col, tile, letter in board.enum_tiles())
-        self._tiles = Alphabet.string_subtract(self._tiles, board_tiles)
+        self._subtract(tile for row, col, tile, letter in board.enum_tiles())
 
     def subtract_rack(self, rack):
         """ Subtract all tiles in the rack from the bag """
-        self._tiles = Alphabet.string_subtract(self._tiles, rack)
+        self._subtract(rack)
 
 
 class Rack:
 
-    """ Represents a player's rack of tiles """
+    """ Represents a player's rack of tiles, as a list of tile counts
+        indexed by tile code, i.e. by position in Alphabet.all_tiles,
+        along with a string of the tiles in the order they were drawn """
 
     MAX_TILES = 7
 
     def __init__(self, copy = None):
 
         if copy is None:
+            self._counts = [0] * len(Alphabet.all_tiles)
+            self._num = 0
             self._tiles = u''
         else:
             # Copy constructor: initialize from another Rack
+            self._counts = copy._counts[:]
+            self._num = copy._num
             self._tiles = copy._tiles
 
     def remove_tile(self, tile):
         """ Remove a tile from the rack """
-        self._tiles = self._tiles.replace(tile, u'', 1)
+        ix = Alphabet.tile_index.get(tile)
+        if ix is not None and self._counts[ix] > 0:
+            self._counts[ix] -= 1
+            self._num -= 1
+            self._tiles = self._tiles.replace(tile, u'', 1)
 
     def replenish(self, bag):
         """ Draw tiles from the bag until we have 7 tiles or the bag is empty """
-        while len(self._tiles) < Rack.MAX_TILES and not bag.is_empty():
-            self._tiles += bag.draw_tile()
+        counts = self._counts
+        tile_index = Alphabet.tile_index
+        drawn = u''
+        while self._num < Rack.MAX_TILES and not bag.is_empty():
+            tile = bag.draw_tile()
+            counts[tile_index[tile]] += 1
+            self._num += 1
+            drawn += tile
+        self._tiles += drawn
 
     def contents(self):
-        """ Return the contents of the rack """
+        """ Return the contents of the rack, in the order the tiles were drawn """
         return self._tiles
 
+    def counts(self):
+        """ Return a copy of the contents of the rack, as a list of tile counts """
+        return self._counts[:]
+
+    def checkpoint(self):
+        """ Return a record of the current contents of the rack, for restore() """
+        return (self._counts[:], self._num, self._tiles)
+
+    def restore(self, checkpoint):
+        """ Restore the contents of the rack from a record made by checkpoint() """
+        counts, self._num, self._tiles = checkpoint
+        self._counts[:] = counts
+
     def details(self, tileset):
         """ Return the detailed contents of the rack, i.e. tiles and their scores """
-        return [(t, tileset.scores[t]) for t in self._tiles]
+        return [(t, tileset.scores[t]) for t in self.contents()]
 
     def num_tiles(self):
         """ Return the number of tiles in the rack """
-        return len(self._tiles)
+        return self._num
 
     def is_empty(self):
         """ Is the rack empty? """
@@ -365,14 +689,19 @@ class Rack:
     def set_tiles(self, tiles):
         """ Set the contents of the rack """
         self._tiles = u"" if tiles is None else tiles
+        self._counts = Alphabet.tile_counts(self._tiles)
+        self._num = sum(self._counts)
 
     def contains(self, tiles):
         """ Check whether the rack contains all tiles in the tiles string """
-        # (Quick and dirty, not time-critical)
-        temp = self._tiles
+        counts = self._counts[:]
+        tile_index = Alphabet.tile_index
         for c in tiles:
-            temp = temp.replace(c, u'', 1)
-        return len(self._tiles) - len(temp) == len(tiles)
+            ix = tile_index.get(c)
+            if ix is None or not counts[ix]:
+                return False
+            counts[ix] -= 1
+        return True
 
     def exchange(self, bag, tiles):
         """ Exchange the given tiles with the bag """
@@ -381,8 +710,10 @@ class Rack:
             return False
         # First remove the tiles from the rack and replenish it
         removed = u''
+        tile_index = Alphabet.tile_index
         for c in tiles:
-            if c in self._tiles:
+            ix = tile_index.get(c)
+            if ix is not None and self._counts[ix]:
                 # Be careful and only remove tiles that actually were there
                 self.remove_tile(c)
                 removed += c
@@ -398,15 +729,15 @@ class Rack:
             return
         n = self.num_tiles()
         bag.return_tiles(self._tiles)
-        tiles = []
-        while len(tiles) < n and not bag.is_empty():
-            tiles.append(bag.draw_tile())
-        # Return the tiles sorted in alphabetical order
-        all_tiles = Alphabet.all_tiles
-        def keyfunc(x):
-            return all_tiles.index(x)
-        tiles.sort(key = keyfunc)
-        self._tiles = u''.join(tiles)
+        self._counts = [0] * len(Alphabet.all_tiles)
+        self._num = 0
+        counts = self._counts
+        tile_index = Alphabet.tile_index
+        while self._num < n and not bag.is_empty():
+            counts[tile_index[bag.draw_tile()]] += 1
+            self._num += 1
+        # The fresh tiles are sorted in alphabetical order, with blank tiles last
+        self._tiles = u''.join(tile * n for tile, n in zip(Alphabet.all_tiles, counts) if n)
 
 
 class State:
@@ -415,7 +746,7 @@ class State:
         Contains the current board, the racks, scores, etc.
     """
 
-    def __init__(self, tileset, manual_wordcheck = False, drawtiles = True, copy = None):
+    def __init__(self, tileset, manual_wordcheck = False, drawtiles = True, copy = None, rng = None):
 
         if copy is None:
             self._board = Board()
@@ -431,12 +762,15 @@ class State:
             self._challenge_score = 0 # The score a challenge would get if made (0 if not challengeable)
             self._last_rack = None # The rack before the last challengeable move
             self._last_covers = None # The covers laid down in the last challengeable move
+            self._crosschecks = None # Cross-checks and anchors, calculated on demand
             # Initialize a fresh, full bag of tiles
             self._tileset = tileset
+            # The bag draws tiles using the given random number generator,
+            # or the cryptographic default if none is given
             if manual_wordcheck and _DEBUG_MANUAL_WORDCHECK:
-                self._bag = Bag(tileset, debug = True)
+                self._bag = Bag(tileset, debug = True, rng = rng)
             else:
-                self._bag = Bag(tileset)
+                self._bag = Bag(tileset, rng = rng)
             if drawtiles:
                 # Draw the racks from the bag
                 for rack in self._racks:
@@ -456,12 +790,54 @@ class State:
             self._challenge_score = copy._challenge_score
             self._last_rack = copy._last_rack
             self._last_covers = copy._last_covers
+            self._crosschecks = None if copy._crosschecks is None else CrossChecks(copy = copy._crosschecks)
             self._tileset = copy._tileset
-            self._bag = Bag(tileset = None, copy = copy._bag)
+            self._bag = Bag(tileset = None, copy = copy._bag, rng = rng)
+
+    def set_rng(self, rng):
+        """ Set the random number generator to draw tiles from the bag with,
+            or None for the cryptographic default """
+        self._bag.set_rng(rng)
 
     def load_board(self, board):
         """ Load a Board into this state """
         self._board = board
+        self._crosschecks = None
+
+    def crosschecks(self):
+        """ Return the cross-checks and anchors for the current board,
+            calculating them if required """
+        if self._crosschecks is None or not self._crosschecks.is_valid():
+            self._crosschecks = CrossChecks(self._board, self._tileset.scores)
+        return self._crosschecks
+
+    def cached_crosschecks(self):
+        """ Return the cross-checks and anchors for the current board if they
+            have already been calculated and are valid, or None otherwise """
+        cc = self._crosschecks
+        return cc if cc is not None and cc.is_valid() else None
+
+    def cross_score(self, row, col, horizontal):
+        """ Return the summed scores of the tiles in the cross word that a tile
+            placed in the square would join, for a move in the given direction,
+            or None if it would not form a cross word """
+        if self._crosschecks is not None:
+            # Maintained incrementally as moves are applied
+            return self._crosschecks.cross_score(row, col, horizontal)
+        board = self._board
+        if horizontal:
+            cross = board.tiles_above(row, col) + board.tiles_below(row, col)
+        else:
+            cross = board.tiles_left(row, col) + board.tiles_right(row, col)
+        if not cross:
+            return None
+        scores = self._tileset.scores
+        return sum(scores[tile] for tile in cross)
+
+    def board_changed(self, covers):
+        """ Notify the state that tiles have been placed on or removed from the board """
+        if self._crosschecks is not None:
+            self._crosschecks.changed(self._board, [(c.row, c.col) for c in covers])
 
     def check_legality(self, move):
         """ Is the move legal in this state? """
@@ -491,6 +867,45 @@ class State:
         self._player_to_move = 1 - self._player_to_move
         return True
 
+    def make_move(self, move, rng = None):
+        """ Apply the given move, assumed to be legal, to this state and return
+            an undo record for unmake_move(), or None if the game is over.
+            This allows lookahead on a single state instead of on copies.
+            If an rng is given, it is used to draw tiles from the bag
+            until the move is unmade. """
+        if self.is_game_over():
+            return None
+        bag = self._bag
+        # The racks of both players are recorded, since simulations
+        # typically also draw random racks for the opponent
+        undo = (move, self._player_to_move, self._scores[self._player_to_move],
+            self._num_moves, self._num_passes, self._game_resigned,
+            self._challenge_score, self._last_rack, self._last_covers,
+            self._racks[0].checkpoint(), self._racks[1].checkpoint(),
+            bag.checkpoint(), bag.rng())
+        if rng is not None:
+            bag.set_rng(rng)
+        self.apply_move(move)
+        return undo
+
+    def unmake_move(self, undo):
+        """ Revert a move applied by make_move(), given its undo record,
+            restoring this state exactly as it was before the move """
+        if undo is None:
+            # The move was not applied in the first place
+            return
+        (move, player, score, self._num_moves, self._num_passes, self._game_resigned,
+            self._challenge_score, self._last_rack, self._last_covers,
+            rack0, rack1, bag, rng) = undo
+        self._player_to_move = player
+        self._scores[player] = score
+        self._racks[0].restore(rack0)
+        self._racks[1].restore(rack1)
+        self._bag.restore(bag)
+        self._bag.set_rng(rng)
+        # Revert the board, now that the challengeable state has been restored
+        move.unapply(self)
+
     @property
     def tileset(self):
         """ Return the tileset for this game state """
@@ -801,6 +1216,13 @@ class MoveBase(object):
         """ Should be overridden in derived classes """
         raise NotImplementedError
 
+    # noinspection PyMethodMayBeStatic,PyUnusedLocal
+    def unapply(self, state):
+        """ Revert the changes made to the board by applying this move.
+            The rest of the state is restored by State.unmake_move(). """
+        # Most moves do not change the board
+        pass
+
 
 class Move(MoveBase):
 
@@ -1071,12 +1493,25 @@ class Move(MoveBase):
                     self._word += ltr
                     self._tiles += ltr
 
-        def is_valid_word(word):
-            """ Check whether a word is in the dictionary, unless this is a manual game """
-            return True if state.manual_wordcheck else word in Wordbase.dawg()
+        # If the cross-checks are available, they tell whether the letter
+        # of each cover forms a valid cross word, so the cross words need not
+        # be formed. Otherwise, collect the cross words formed by the new tiles.
+        crosschecks = None
+        cross_words = []
+        if not board.is_empty() and not state.manual_wordcheck:
+            crosschecks = state.cached_crosschecks()
+            if crosschecks is None:
+                cross_words = self.cross_words(board)
+
+        # Check the word and the cross words against the dictionary in
+        # one batch, unless this is a manual game
+        if state.manual_wordcheck:
+            valid = [True]
+        else:
+            valid = Wordbase.dawg().find_many([self._word] + cross_words)
 
         # Check whether the word is in the dictionary
-        if not is_valid_word(self._word):
+        if not valid[0]:
             return (Error.WORD_NOT_IN_DICTIONARY, self._word)
 
         # Check that the play is adjacent to some previously placed tile
@@ -1095,36 +1530,39 @@ class Move(MoveBase):
             if not any([board.has_adjacent(c.row, c.col) for c in self._covers]):
                 return Error.NOT_ADJACENT
             # Check all cross words formed by the new tiles
-            for c in self._covers:
-                if self._horizontal:
-                    cross = board.letters_above(c.row, c.col) + c.letter + board.letters_below(c.row, c.col)
-                else:
-                    cross = board.letters_left(c.row, c.col) + c.letter + board.letters_right(c.row, c.col)
-                if len(cross) > 1 and not is_valid_word(cross):
+            if crosschecks is not None:
+                letter_bit = Alphabet.letter_bit
+                for c in self._covers:
+                    if not crosschecks.crosscheck(c.row, c.col, self._horizontal) & letter_bit.get(c.letter, 0):
+                        return (Error.CROSS_WORD_NOT_IN_DICTIONARY, self.cross_word(board, c))
+            for cross, ok in zip(cross_words, valid[1:]):
+                if not ok:
                     return (Error.CROSS_WORD_NOT_IN_DICTIONARY, cross)
 
         # All checks pass: the play is legal
         return Error.LEGAL
 
-    def check_words(self, board):
-        """ Do simple word validation on this move, returning a list of invalid words formed """
-
-        invalid = []
+    def cross_word(self, board, c):
+        """ Return the cross word formed by the tile of the cover c,
+            which is a single letter if there is no cross word """
+        if self._horizontal:
+            return board.letters_above(c.row, c.col) + c.letter + board.letters_below(c.row, c.col)
+        return board.letters_left(c.row, c.col) + c.letter + board.letters_right(c.row, c.col)
 
-        # Check whether the main word is in the dictionary
-        if self._word not in Wordbase.dawg():
-            invalid.append(self._word)
-
-        # Check all cross words formed by the new tiles
+    def cross_words(self, board):
+        """ Return a list of the cross words formed by the new tiles, in cover order """
+        words = []
         for c in self._covers:
-            if self._horizontal:
-                cross = board.letters_above(c.row, c.col) + c.letter + board.letters_below(c.row, c.col)
-            else:
-                cross = board.letters_left(c.row, c.col) + c.letter + board.letters_right(c.row, c.col)
-            if len(cross) > 1 and cross not in Wordbase.dawg():
-                invalid.append(cross)
+            cross = self.cross_word(board, c)
+            if len(cross) > 1:
+                words.append(cross)
+        return words
 
-        return invalid # Returns an empty list if all words are valid
+    def check_words(self, board):
+        """ Do simple word validation on this move, returning a list of invalid words formed """
+        # Check the main word and all cross words formed by the new tiles in one batch
+        words = [self._word] + self.cross_words(board)
+        return [w for w, ok in zip(words, Wordbase.dawg().find_many(words)) if not ok]
 
     def score(self, state):
         """ Calculate the score of this move, which is assumed to be legal """
@@ -1170,15 +1608,12 @@ class Move(MoveBase):
 
         # Tally the scores of words formed across the primary word
         for c in self._covers:
-            if self._horizontal:
-                cross = board.tiles_above(c.row, c.col) + board.tiles_below(c.row, c.col)
-            else:
-                cross = board.tiles_left(c.row, c.col) + board.tiles_right(c.row, c.col)
-            if cross:
+            cross = state.cross_score(c.row, c.col, self._horizontal)
+            if cross is not None:
                 sc = scores[c.tile]
                 sc *= Board.letterscore(c.row, c.col)
                 wsc = Board.wordscore(c.row, c.col)
-                sc += sum(scores[tile] for tile in cross)
+                sc += cross
                 total += sc * wsc
         # Add the bingo bonus of 50 points for playing all (seven) tiles
         if numcovers == Rack.MAX_TILES:
@@ -1198,6 +1633,7 @@ class Move(MoveBase):
             board.set_tile(c.row, c.col, c.tile)
             if not shallow:
                 rack.remove_tile(c.tile)
+        state.board_changed(self._covers)
         state.reset_passes()
         if state.manual_wordcheck:
             # A normal tile-play move is challengeable
@@ -1215,6 +1651,14 @@ class Move(MoveBase):
             # Automatic wordcheck: not challengeable
             state.clear_challengeable()
 
+    def unapply(self, state):
+        """ Remove the tiles laid down by this move from the board """
+        board = state.board()
+        for c in self._covers:
+            board.set_letter(c.row, c.col, u' ')
+            board.set_tile(c.row, c.col, u' ')
+        state.board_changed(self._covers)
+
 
 class ExchangeMove(MoveBase):
 
@@ -1374,6 +1818,7 @@ class ResponseMove(MoveBase):
             for c in last_covers:
                 board.set_letter(c.row, c.col, u' ')
                 board.set_tile(c.row, c.col, u' ')
+            state.board_changed(last_covers)
             if not shallow:
                 # Reset the opponent's rack to what it was before the move
                 bag = state.bag()
@@ -1386,6 +1831,16 @@ class ResponseMove(MoveBase):
                 bag.subtract_rack(rack.contents())
         state.clear_challengeable()
 
+    def unapply(self, state):
+        """ Put the tiles of a successfully challenged move back on the board """
+        if self._num_covers < 0:
+            board = state.board()
+            last_covers = state.last_covers
+            for c in last_covers:
+                board.set_letter(c.row, c.col, c.letter)
+                board.set_tile(c.row, c.col, c.tile)
+            state.board_changed(last_covers)
+
 
 class PassMove(MoveBase):
 
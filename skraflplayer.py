@@ -68,11 +68,16 @@
 
 """
 
-from random import randint
-
-from dawgdictionary import Wordbase
+import logging
+import atexit
+import threading
+import heapq
+from collections import OrderedDict
+from random import randint, Random
+
+from dawgdictionary import Wordbase, NavigatorConstraints, GaddagConstraints
 from languages import Alphabet
-from skraflmechanics import State, Board, Cover, Move, ExchangeMove, PassMove
+from skraflmechanics import Board, Rack, Move, ExchangeMove, PassMove
 
 
 class Square:
@@ -94,14 +99,14 @@ class Square:
         # Is this an anchor square?
         self._anchor = False
 
-    def init(self, autoplayer, row, col, crosscheck):
+    def init(self, autoplayer, row, col, crosscheck, anchor):
         """ Initialize this square from the board """
         board = autoplayer.board()
         self._tile = board.tile_at(row, col)
         self._letter = board.letter_at(row, col)
         # Cross checks and anchors
         self._cc = crosscheck
-        if self.is_open() and board.has_adjacent(row, col):
+        if self.is_open() and anchor:
             # Empty square with adjacent covered squares and nonzero cross-checks:
             # mark as anchor
             self.mark_anchor()
@@ -138,19 +143,38 @@ class Axis:
         for an AutoPlayer.
     """
 
-    DAWG = Wordbase.dawg()
-
     def __init__(self, autoplayer, index, horizontal):
 
         self._autoplayer = autoplayer
+        # Fetch the DAWG here rather than at module load time,
+        # so that importing this module does not block on loading it
+        self._dawg = Wordbase.dawg()
         self._sq = [None] * Board.SIZE
         for i in range(Board.SIZE):
             self._sq[i] = Square()
         self._index = index
         self._horizontal = horizontal
-        self._rack = autoplayer.rack()
+        # The rack as a list of tile counts, indexed by tile code
+        self._rack = autoplayer.rack_counts()
         # Bit pattern representing empty squares on this axis
         self._empty_bits = 0
+        # Navigation constraints for each square, used by ExtendRightNavigator:
+        # a bit pattern of the letters allowed in the square, whether the letter is already
+        # on the board (and thus not taken from the rack), and whether a word
+        # can end just before the square (the last entry is past the board edge)
+        self._allowed = [None] * Board.SIZE
+        self._on_board = [False] * Board.SIZE
+        self._word_end = [True] * (Board.SIZE + 1)
+        # Cache of the above constraints by word start index
+        self._constraints = dict()
+        # Scoring data for each square, used to score candidates as they are generated:
+        # the letter and word multipliers, the score of a tile already on the board,
+        # and the summed tile scores of the cross word that a tile placed in an
+        # empty square would join (None if there is no cross word)
+        self._letter_mult = [1] * Board.SIZE
+        self._word_mult = [1] * Board.SIZE
+        self._board_score = [0] * Board.SIZE
+        self._cross_score = [None] * Board.SIZE
 
     def is_horizontal(self):
         """ Is this a horizontal (row) axis? """
@@ -193,8 +217,11 @@ class Axis:
         """ Calculate and return a list of cross-check bit patterns for the indicated axis """
 
         # The cross-check set is the set of letters that can appear in a square
-        # and make cross words (above/left and/or below/right of the square) valid
+        # and make cross words (above/left and/or below/right of the square) valid.
+        # These are maintained by the game state across moves, independently of the rack.
         board = self._autoplayer.board()
+        crosschecks = self._autoplayer.crosschecks()
+        horizontal = self._horizontal
         # Prepare to visit all squares on the axis
         x, y = self.coordinate_of(0)
         xd, yd = self.coordinate_step()
@@ -203,41 +230,46 @@ class Axis:
         # contains all letters in the Alphabet. Otherwise, it contains the
         # letters in the rack.
         all_cc = self._autoplayer.rack_bit_pattern()
+        scores = self._autoplayer.tile_scores()
+        # Keep track of empty squares within the axis in a bit pattern for speed
+        self._empty_bits = ~board.occupied_bits(self._index, horizontal) & ((1 << Board.SIZE) - 1)
         # Go through the open squares and calculate their cross-checks
         for ix in range(Board.SIZE):
             cc = all_cc # Start with the default cross-check set
             if not board.is_covered(x, y):
-                if self.is_horizontal():
-                    above = board.letters_above(x, y)
-                    below = board.letters_below(x, y)
-                else:
-                    above = board.letters_left(x, y)
-                    below = board.letters_right(x, y)
-                query = above or u''
-                query += u'?'
-                if below:
-                    query += below
-                if len(query) > 1:
-                    # Nontrivial cross-check: Query the word database for words that fit this pattern
-                    matches = self.DAWG.find_matches(query, sort = False) # Don't need a sorted result
-                    bits = 0
-                    if matches:
-                        cix = len(above) if above else 0
-                        # Note the set of allowed letters here
-                        bits = Alphabet.bit_pattern([wrd[cix] for wrd in matches])
-                    # Reduce the cross-check set by intersecting it with the allowed set.
-                    # If the cross-check set and the rack have nothing in common, this
-                    # will lead to the square being marked as closed, which saves
-                    # calculation later on
-                    cc &= bits
+                # Reduce the cross-check set by intersecting it with the allowed set.
+                # If the cross-check set and the rack have nothing in common, this
+                # will lead to the square being marked as closed, which saves
+                # calculation later on
+                cc &= crosschecks.crosscheck(x, y, horizontal)
             # Initialize the square
-            self._sq[ix].init(self._autoplayer, x, y, cc)
-            # Keep track of empty squares within the axis in a bit pattern for speed
-            if self._sq[ix].is_empty():
-                self._empty_bits |= (1 << ix)
+            sq = self._sq[ix]
+            sq.init(self._autoplayer, x, y, cc, crosschecks.is_anchor(x, y))
+            if sq.is_empty():
+                self._allowed[ix] = cc
+                self._letter_mult[ix] = Board.letterscore(x, y)
+                self._word_mult[ix] = Board.wordscore(x, y)
+                self._cross_score[ix] = crosschecks.cross_score(x, y, horizontal)
+            else:
+                self._allowed[ix] = Alphabet.letter_bit[sq.letter()]
+                self._on_board[ix] = True
+                self._word_end[ix] = False
+                self._board_score[ix] = scores[board.tile_at(x, y)]
             x += xd
             y += yd
 
+    def constraints(self, start):
+        """ Return the per-square navigation constraints for words
+            starting at the start index, as a tuple of lists indexed
+            by distance from the start: (allowed, on_board, word_end) """
+        c = self._constraints.get(start)
+        if c is None:
+            word_end = self._word_end[start:]
+            # Single-letter words are not moves
+            word_end[0] = word_end[1] = False
+            c = self._constraints[start] = (self._allowed[start:], self._on_board[start:], word_end)
+        return c
+
     def _gen_moves_from_anchor(self, index, maxleft, lpn):
         """ Find valid moves emanating (on the left and right) from this anchor """
         if maxleft == 0 and index > 0 and not self.is_empty(index - 1):
@@ -249,37 +281,116 @@ class Axis:
                 ix -= 1
             # Use the ExtendRightNavigator to find valid words with this left part
             nav = LeftFindNavigator(leftpart)
-            self.DAWG.navigate(nav)
+            self._dawg.navigate(nav)
             ns = nav.state()
             if ns is not None:
                 # We found a matching prefix in the graph
                 _, prefix, nextnode = ns
                 # assert matched == leftpart
                 nav = ExtendRightNavigator(self, index, self._rack)
-                self.DAWG.resume_navigation(nav, prefix, nextnode, leftpart)
+                self._dawg.resume_navigation(nav, prefix, nextnode, leftpart)
             return
 
         # We are not completing an existing left part
         # Begin by extending an empty prefix to the right, i.e. placing
         # tiles on the anchor square itself and to its right
         nav = ExtendRightNavigator(self, index, self._rack)
-        self.DAWG.navigate(nav)
+        self._dawg.navigate(nav)
 
         if maxleft > 0 and lpn is not None:
             # Follow this by an effort to permute left prefixes into the open space
-            # to the left of the anchor square
+            # to the left of the anchor square, skipping those that cannot be
+            # followed by any of the letters allowed on the anchor
+            allowed = self._allowed[index]
             for leftlen in range(1, maxleft + 1):
                 lplist = lpn.leftparts(leftlen)
                 if lplist is not None:
-                    for leftpart, rackleave, prefix, nextnode in lplist:
-                        nav = ExtendRightNavigator(self, index, rackleave)
-                        self.DAWG.resume_navigation(nav, prefix, nextnode, leftpart)
+                    for leftpart, rackleave, prefix, nextnode, follow in lplist:
+                        if follow & allowed:
+                            nav = ExtendRightNavigator(self, index, Alphabet.tile_counts(rackleave))
+                            self._dawg.resume_navigation(nav, prefix, nextnode, leftpart)
+
+    def _gen_moves_gaddag(self, index, gaddag):
+        """ Find valid moves through this anchor in a single pass, using a GADDAG """
+        sq = self._sq
+        # Going left from the anchor, letters can be placed on the anchor itself,
+        # on tiles already on the board and on open squares up to the previous anchor
+        left_allowed = [self._allowed[index]]
+        left_free = [False]
+        ix = index - 1
+        while ix >= 0 and (self._on_board[ix] or (sq[ix].is_open() and not sq[ix].is_anchor())):
+            left_allowed.append(self._allowed[ix])
+            left_free.append(self._on_board[ix])
+            ix -= 1
+        # A word can start where the square to its left is empty
+        left_turn = [False] + [d > index or self._word_end[index - d]
+            for d in range(1, len(left_allowed) + 1)]
+        right = index + 1
+
+        def report(word, leftlen):
+            self.add_move(word, index - leftlen + 1)
+
+        gaddag.navigate_gaddag(GaddagConstraints(left_allowed, left_free, left_turn,
+            self._allowed[right:], self._on_board[right:], self._word_end[right:],
+            self._rack, report))
+
+    def add_move(self, matched, ix):
+        """ Make a scored candidate record for a solution starting at the
+            index ix within the axis and add it to the AutoPlayer's list """
+        row, col = self.coordinate_of(ix)
+        # Fetch the rack as it was at the beginning of move generation
+        autoplayer = self._autoplayer
+        rack = autoplayer.rack()
+        scores = autoplayer.tile_scores()
+        tiles = u''
+        num_covers = 0
+        # Sum of letter scores and word score multiplier of the primary word
+        sc = 0
+        wsc = 1
+        # Total score of words formed across the primary word
+        cross_total = 0
+        for c in matched:
+            if self.is_empty(ix):
+                # Empty square that is being covered by this move
+                # Find out whether it is a blank or normal letter tile
+                if c in rack:
+                    rack = rack.replace(c, u'', 1)
+                    tiles += c
+                    lscore = scores[c] * self._letter_mult[ix]
+                else:
+                    # Must be a wildcard match, which scores nothing
+                    rack = rack.replace(u'?', u'', 1)
+                    tiles += u'?' + c
+                    lscore = 0
+                wscore = self._word_mult[ix]
+                sc += lscore
+                wsc *= wscore
+                cross = self._cross_score[ix]
+                if cross is not None:
+                    cross_total += (lscore + cross) * wscore
+                num_covers += 1
+            else:
+                tiles += c
+                sc += self._board_score[ix]
+            ix += 1
+        score = sc * wsc + cross_total
+        # Add the bingo bonus of 50 points for playing all (seven) tiles
+        if num_covers == Rack.MAX_TILES:
+            score += Move.BINGO_BONUS
+        autoplayer.add_candidate((row, col, self._horizontal, matched, tiles, num_covers, score))
 
     def generate_moves(self, lpn):
         """ Find all valid moves on this axis by attempting to place tiles
             at and around all anchor squares """
+        gaddag = self._autoplayer.gaddag()
+        if gaddag is not None:
+            # Generate moves outward from each anchor, without left parts
+            for i in range(Board.SIZE):
+                if self._sq[i].is_anchor():
+                    self._gen_moves_gaddag(i, gaddag)
+            return
         last_anchor = -1
-        lenrack = len(self._rack)
+        lenrack = len(self._autoplayer.rack())
         for i in range(Board.SIZE):
             if self._sq[i].is_anchor():
                 # Count the consecutive open, non-anchor squares on the left of the anchor
@@ -294,79 +405,226 @@ class Axis:
                 last_anchor = i
 
     
+def _tile_code(ch):
+    """ Return the integer code of a letter, or the code of the blank tile
+        for letters outside the alphabet, which only a blank tile can match """
+    return Alphabet.tile_index.get(ch, Alphabet.BLANK)
+
+
+def _restore_tiles(rack, taken, num_taken):
+    """ Put tiles back into a rack of tile counts, leaving the first
+        num_taken tiles in the taken list """
+    for tile in taken[num_taken:]:
+        rack[tile] += 1
+    del taken[num_taken:]
+
+
 class LeftPermutationNavigator:
 
     """ A navigation class to be used with DawgDictionary.navigate()
         to find all left parts of words that are possible with
         a particular rack. The results are accumulated by length.
-        This calculation is only done once at the start of move
-        generation for a particular rack and board.
+        This calculation is only done once for a particular rack,
+        and the results are shared via the LeftPartCache.
+
+        Each left part is stored with a bit pattern of the letters that
+        can follow it on the anchor square, i.e. the letters that continue
+        a word in the DAWG and are still available in the rack leave. Left
+        parts that cannot be continued are dropped, and the others are only
+        tried on anchors that allow one of their following letters. This
+        keeps racks with blank tiles, which match every letter, from
+        resuming navigation for every left part at every anchor.
     """
 
     def __init__(self, rack):
-        self._rack = rack
+        # The rack as a list of tile counts, indexed by tile code
+        self._rack = Alphabet.tile_counts(rack)
+        # The codes of the tiles taken from the rack along the current path
+        self._taken = []
         self._stack = []
         self._maxleft = len(rack) - 1 # One tile on the anchor itself
         # assert self._maxleft > 0
         self._leftparts = [None] * self._maxleft
+        # The bit patterns of the letters that can follow each left part
+        self._follow = dict()
+        # Rack leave strings, shared between left parts with the same leave
+        self._leaves = dict()
+        self._count = 0
         self._index = 0
 
     def leftparts(self, length):
         """ Returns a list of leftparts of the length requested """
         return self._leftparts[length - 1] if 0 < length <= self._maxleft else None
 
+    def count(self):
+        """ Returns the total number of left parts """
+        return self._count
+
     def push_edge(self, firstchar):
         """ Returns True if the edge should be entered or False if not """
         # Follow all edges that match a letter in the rack
         # (which can be '?', matching all edges)
-        if not ((firstchar in self._rack) or (u'?' in self._rack)):
+        rack = self._rack
+        if not (rack[_tile_code(firstchar)] or rack[Alphabet.BLANK]):
             return False
-        # Fit: save our rack and move into the edge
-        self._stack.append((self._rack, self._index))
+        # Fit: note our position and move into the edge
+        self._stack.append((self._index, len(self._taken)))
         return True
 
     def accepting(self):
         """ Returns False if the navigator does not want more characters """
         # Continue until we have generated all left parts possible from the
-        # rack but leaving at least one tile
-        return self._index < self._maxleft
+        # rack but leaving at least one tile, plus the letters following them
+        return self._index <= self._maxleft
 
     def accepts(self, newchar):
         """ Returns True if the navigator will accept the new character """
-        exactmatch = newchar in self._rack
-        if (not exactmatch) and (u'?' not in self._rack):
-            # Can't continue with this prefix - we no longer have rack letters matching it
-            return False
+        rack = self._rack
+        tile = _tile_code(newchar)
+        if not rack[tile]:
+            tile = Alphabet.BLANK
+            if not rack[tile]:
+                # Can't continue with this prefix - we no longer have rack letters matching it
+                return False
         # We're fine with this: accept the character and remove from the rack
         self._index += 1
-        if exactmatch:
-            self._rack = self._rack.replace(newchar, u'', 1)
-        else:
-            self._rack = self._rack.replace(u'?', u'', 1)
+        rack[tile] -= 1
+        self._taken.append(tile)
         return True
 
     def accept_resumable(self, prefix, nextnode, matched):
         """ Called to inform the navigator of a match and whether it is a final word """
-        # Accumulate all possible left parts, by length
+        # Note the last letter as one that can follow the shorter left part
         lm = len(matched) - 1
+        if lm > 0:
+            part = matched[0 : lm]
+            self._follow[part] = self._follow.get(part, 0) | Alphabet.letter_bit[matched[lm]]
+        if lm == self._maxleft:
+            # Too long to be a left part
+            return
+        # Accumulate all possible left parts, by length
         if self._leftparts[lm] is None:
             self._leftparts[lm] = list()
-        # Store the matched word part as well as the remaining part
-        # of the prefix of the edge we were on, and the next node.
-        # This gives us the ability to resume the navigation later at
-        # the saved point, to generate right parts.
-        self._leftparts[lm].append((matched, self._rack, prefix, nextnode))
+        # Store the matched word part and the rack leave, as a string of
+        # tiles, as well as the remaining part of the prefix of the edge
+        # we were on, and the next node. This gives us the ability to resume
+        # the navigation later at the saved point, to generate right parts.
+        leave = u''.join(tile * n for tile, n in zip(Alphabet.all_tiles, self._rack) if n)
+        leave = self._leaves.setdefault(leave, leave)
+        self._leftparts[lm].append((matched, leave, prefix, nextnode))
 
     def pop_edge(self):
         """ Called when leaving an edge that has been navigated """
-        self._rack, self._index = self._stack.pop()
+        self._index, num_taken = self._stack.pop()
+        # Put back the tiles taken from the rack within the edge
+        _restore_tiles(self._rack, self._taken, num_taken)
         # We need to visit all outgoing edges, so return True
         return True
 
-    # noinspection PyMethodMayBeStatic
     def done(self):
         """ Called when the whole navigation is done """
-        pass
+        # Add the following letters to the left parts, dropping the ones
+        # that cannot be continued, and freeze the left parts, which may
+        # subsequently be shared between threads
+        follow = self._follow
+        leftparts = []
+        for lp in self._leftparts:
+            if lp is not None:
+                lp = tuple((leftpart, rackleave, prefix, nextnode, follow[leftpart])
+                    for leftpart, rackleave, prefix, nextnode in lp if leftpart in follow)
+                self._count += len(lp)
+            leftparts.append(lp or None)
+        self._leftparts = leftparts
+        self._follow = None
+        self._leaves = None
+
+
+class LeftPartCache:
+
+    """ A process-wide, bounded LRU cache of the left parts that can be
+        formed from a rack, keyed by the sorted rack. Left parts depend only
+        on the rack and the DAWG, not on the board, so the cache is shared by
+        all AutoPlayer instances across moves and games. The cached
+        navigators are frozen and not modified by move generation, so
+        they can be used by several threads at once.
+
+        The cache is bounded by the total number of left parts it holds,
+        since a rack with blank tiles can have thousands of left parts
+        while most racks have a few dozen. It is cleared when the
+        dictionaries are reloaded.
+    """
+
+    MAX_LEFTPARTS = 50000
+
+    _lock = threading.Lock()
+    _entries = OrderedDict()
+    # The total number of left parts in the cached entries
+    _leftparts = 0
+    # The DAWG for which the cached entries are valid, and whether it was
+    # compiled, since that changes the form of the resumable graph positions
+    _dawg = None
+    _compiled = False
+    _hits = 0
+    _misses = 0
+    _evictions = 0
+
+    @classmethod
+    def lookup(cls, dawg, rack):
+        """ Return a LeftPermutationNavigator holding the left parts of
+            the rack, navigating the DAWG only on a cache miss """
+        key = u''.join(sorted(rack))
+        compiled = dawg.is_compiled()
+        with cls._lock:
+            if dawg is not cls._dawg or compiled != cls._compiled:
+                # The dictionary has changed: the cached entries are stale
+                cls._entries.clear()
+                cls._leftparts = 0
+                cls._dawg = dawg
+                cls._compiled = compiled
+            lpn = cls._entries.pop(key, None)
+            if lpn is not None:
+                # Re-insert to mark the entry as the most recently used one
+                cls._entries[key] = lpn
+                cls._hits += 1
+                return lpn
+            cls._misses += 1
+        # Navigate the DAWG outside the lock
+        lpn = LeftPermutationNavigator(rack)
+        dawg.navigate(lpn)
+        with cls._lock:
+            entries = cls._entries
+            if dawg is cls._dawg and compiled == cls._compiled and key not in entries:
+                if lpn.count() <= cls.MAX_LEFTPARTS:
+                    entries[key] = lpn
+                    cls._leftparts += lpn.count()
+                while cls._leftparts > cls.MAX_LEFTPARTS:
+                    # Evict the least recently used entry
+                    _, evicted = entries.popitem(last = False)
+                    cls._leftparts -= evicted.count()
+                    cls._evictions += 1
+        return lpn
+
+    @classmethod
+    def clear(cls):
+        """ Remove all entries from the cache, and release the dictionary """
+        with cls._lock:
+            cls._entries.clear()
+            cls._leftparts = 0
+            cls._dawg = None
+
+    @classmethod
+    def stats(cls):
+        """ Return a dict of cache statistics """
+        with cls._lock:
+            lookups = cls._hits + cls._misses
+            return dict(
+                entries = len(cls._entries),
+                leftparts = cls._leftparts,
+                hits = cls._hits,
+                misses = cls._misses,
+                evictions = cls._evictions,
+                hit_rate = float(cls._hits) / lookups if lookups else 0.0
+            )
 
 
 class LeftFindNavigator:
@@ -443,12 +701,16 @@ class ExtendRightNavigator:
 
     def __init__(self, axis, anchor, rack):
         self._axis = axis
-        self._rack = rack
+        # The rack as a list of tile counts, indexed by tile code
+        self._rack = list(rack)
+        # The number of tiles left in the rack
+        self._count = sum(rack)
+        # The codes of the tiles taken from the rack along the current path
+        self._taken = []
         self._anchor = anchor
         # The tile we are placing next
         self._index = anchor
         self._stack = []
-        self._wildcard_in_rack = u'?' in rack
         # Cache the initial check we do when pushing into an edge
         self._last_check = None
 
@@ -461,7 +723,8 @@ class ExtendRightNavigator:
             # There is a tile already in the square: we must match it exactly
             return Match.BOARD_TILE if ch == l_at_sq else Match.NO
         # Does the current rack allow this letter?
-        if not (self._wildcard_in_rack or ch in self._rack):
+        rack = self._rack
+        if not (rack[Alphabet.BLANK] or rack[_tile_code(ch)]):
             return Match.NO
         # Open square: apply cross-check constraints to the rack
         # Would this character pass the cross-checks?
@@ -473,8 +736,8 @@ class ExtendRightNavigator:
         self._last_check = self._check(firstchar)
         if self._last_check == Match.NO:
             return False
-        # Match: save our rack and our index and move into the edge
-        self._stack.append((self._rack, self._index, self._wildcard_in_rack))
+        # Match: note our position and move into the edge
+        self._stack.append((self._index, len(self._taken)))
         return True
 
     def accepting(self):
@@ -485,7 +748,7 @@ class ExtendRightNavigator:
             return False
         # Otherwise, continue while we have something on the rack
         # or we're at an occupied square
-        return bool(self._rack) or not self._axis.is_empty(self._index)
+        return self._count > 0 or not self._axis.is_empty(self._index)
 
     def accepts(self, newchar):
         """ Returns True if the navigator will accept the new character """
@@ -500,13 +763,14 @@ class ExtendRightNavigator:
         self._index += 1
         if match == Match.RACK_TILE:
             # We used a rack tile: remove it from the rack before continuing
-            if newchar in self._rack:
-                self._rack = self._rack.replace(newchar, u'', 1)
-            else:
+            tile = _tile_code(newchar)
+            if not self._rack[tile]:
                 # Must be wildcard: remove it
-                # assert u'?' in self._rack
-                self._rack = self._rack.replace(u'?', u'', 1)
-            self._wildcard_in_rack = u'?' in self._rack
+                # assert self._rack[Alphabet.BLANK]
+                tile = Alphabet.BLANK
+            self._rack[tile] -= 1
+            self._taken.append(tile)
+            self._count -= 1
         return True
 
     def accept(self, matched, final):
@@ -514,46 +778,27 @@ class ExtendRightNavigator:
         if final and len(matched) > 1 and (self._index >= Board.SIZE or
             self._axis.is_empty(self._index)):
 
-            # Solution found - make a Move object for it and add it to the AutoPlayer's list
-            ix = self._index - len(matched) # The word's starting index within the axis
-            row, col = self._axis.coordinate_of(ix)
-            xd, yd = self._axis.coordinate_step()
-            move = Move(matched, row, col, self._axis.is_horizontal())
-            # Fetch the rack as it was at the beginning of move generation
-            autoplayer = self._axis._autoplayer
-            rack = autoplayer.rack()
-            tiles = u''
-            for c in matched:
-                if self._axis.is_empty(ix):
-                    # Empty square that is being covered by this move
-                    # Find out whether it is a blank or normal letter tile
-                    if c in rack:
-                        rack = rack.replace(c, u'', 1)
-                        tile = c
-                        tiles += c
-                    else:
-                        # Must be a wildcard match
-                        rack = rack.replace(u'?', u'', 1)
-                        tile = u'?'
-                        tiles += tile + c
-                    # assert row in range(Board.SIZE)
-                    # assert col in range(Board.SIZE)
-                    # Add this cover to the Move object
-                    move.add_validated_cover(Cover(row, col, tile, c))
-                else:
-                    tiles += c
-                ix += 1
-                row += xd
-                col += yd
-            # Note the tiles played in the move
-            move.set_tiles(tiles)
-            # Check that we've picked off the correct number of tiles
-            # assert len(rack) == len(self._rack)
-            autoplayer.add_candidate(move)
+            # Solution found
+            self._axis.add_move(matched, self._index - len(matched))
+
+    def constraints(self, depth):
+        """ Describe this navigator declaratively for iterative navigation,
+            where depth is the length of the left part already matched """
+        start = self._anchor - depth # The word's starting index within the axis
+        allowed, free, ends = self._axis.constraints(start)
+
+        def report(matched):
+            self._axis.add_move(matched, start)
+
+        return NavigatorConstraints(Board.SIZE - start, allowed, ends, report,
+            rack = self._rack, free = free)
 
     def pop_edge(self):
         """ Called when leaving an edge that has been navigated """
-        self._rack, self._index, self._wildcard_in_rack = self._stack.pop()
+        self._index, num_taken = self._stack.pop()
+        # Put back the tiles taken from the rack within the edge
+        self._count += len(self._taken) - num_taken
+        _restore_tiles(self._rack, self._taken, num_taken)
         # Once past the prefix, we need to visit all outgoing edges, so return True
         return True
 
@@ -563,6 +808,111 @@ class ExtendRightNavigator:
         pass
 
 
+class CandidateSelector:
+
+    """ Selects the top candidates from a stream of candidate move records,
+        in the order in which the AutoPlayer ranks them: by descending score,
+        then by ascending number of tiles covered (or, in the first move,
+        by ascending row, to go to the upper half of the board for a more
+        open game), and finally by the order of generation.
+
+        Only a bounded heap of candidates is kept, so memory use and sorting
+        time do not depend on the total number of candidates. All candidates
+        having the top score are kept in addition to the (size - 1) best
+        candidates below them, since the AutoPlayer may slide its selection
+        window past ties at the top. If size is None, all candidates are kept.
+
+        An optional accept function filters the candidates. It is only called
+        for candidates that are good enough to be selected.
+    """
+
+    def __init__(self, size, first_move, accept = None):
+        self._size = size
+        self._first_move = first_move
+        # Index of the tie-breaking field within candidate records
+        self._tiebreak = 0 if first_move else 5
+        self._accept = accept
+        # Heap of (score, -tiebreak, -sequence number, candidate) tuples,
+        # with the worst selected candidate at the top
+        self._heap = []
+        # The best score selected, and how many selected candidates have it
+        self._best = None
+        self._ties = 0
+        # Number of candidates offered, and the first one of them
+        self._count = 0
+        self._first = None
+
+    def count(self):
+        """ Return the number of candidates offered to the selector """
+        return self._count
+
+    def first(self):
+        """ Return the first candidate offered to the selector, if any """
+        return self._first
+
+    def params(self):
+        """ Return the size and first move flag of the selector, and whether
+            it filters candidates, for creating an equivalent selector
+            in a worker process """
+        return self._size, self._first_move, self._accept is not None
+
+    def merge(self, candidates, count, first):
+        """ Offer the candidates selected by equivalent selectors in worker
+            processes to this selector, which must be empty, given the total
+            number of candidates offered in the workers and the first of them """
+        for candidate in candidates:
+            self.add(candidate)
+        self._count = count
+        self._first = first
+
+    def add(self, candidate):
+        """ Offer a candidate record to the selector """
+        # !!! TODO: Insert more sophisticated ranking logic here,
+        # including whether triple-word-score opportunities
+        # are being opened for the opponent, minimal use
+        # of blank tiles, leaving a good vowel/consonant
+        # balance on the rack, etc.
+        self._count += 1
+        if self._count == 1:
+            self._first = candidate
+        score = candidate[6]
+        item = (score, - candidate[self._tiebreak], - self._count, candidate)
+        heap = self._heap
+        size = self._size
+        if size is None:
+            # Keeping all candidates: no need to maintain the heap
+            if self._accept is None or self._accept(candidate):
+                heap.append(item)
+            return
+        best = self._best
+        if best is not None and score < best and len(heap) >= size + self._ties - 1 and item < heap[0]:
+            # Worse than all the selected candidates: discard
+            return
+        if self._accept is not None and not self._accept(candidate):
+            return
+        heapq.heappush(heap, item)
+        if best is None or score > best:
+            self._best = score
+            self._ties = 1
+        elif score == best:
+            self._ties += 1
+        # Trim the heap; the candidates removed never have the best score
+        limit = size + self._ties - 1
+        while len(heap) > limit:
+            heapq.heappop(heap)
+
+    def selected(self):
+        """ Return the selected candidates as a list of (candidate, score)
+            tuples, best first """
+        return [(item[3], item[0]) for item in sorted(self._heap, reverse = True)]
+
+    def offered(self):
+        """ Return the selected candidates in the order in which they were
+            offered, as (sequence number, candidate) tuples. The sequence
+            numbers start at 1 and count all candidates offered. """
+        return sorted((- item[2], item[3]) for item in self._heap)
+
+
 class AutoPlayer:
 
     """ Implements an automatic, computer-controlled player.
@@ -577,6 +927,11 @@ class AutoPlayer:
     # The robot level that uses only common words
     AUTOPLAYER_COMMON = 15
 
+    # Robot levels that generate moves from a GADDAG instead of using the
+    # Appel & Jacobson algorithm on the DAWG. If the GADDAG has not
+    # been built, the DAWG is used for all levels.
+    GADDAG_LEVELS = frozenset()
+
     @staticmethod
     def create(state, robot_level = 0):
         """ Create an Autoplayer instance of the desired ability level """
@@ -588,13 +943,23 @@ class AutoPlayer:
 
     def __init__(self, state, robot_level = 0):
 
-        # List of valid, candidate moves
+        # List of valid, candidate moves, as compact records:
+        # (row, col, horizontal, word, tiles, number of tiles covering empty squares, score).
+        # The score is calculated during move generation and equals Move.score().
+        # Move objects are only created for the candidates that are selected.
         self._candidates = []
+        # If set, the CandidateSelector that receives the candidates instead of the list
+        self._selector = None
         self._state = state
         self._board = state.board()
+        self._scores = state.tileset.scores
+        # The cross-checks and anchors of the board, kept up to date by the state
+        self._crosschecks = state.crosschecks()
         # The rack that the autoplayer has to work with
         self._rack = state.player_rack().contents()
         self._robot_level = robot_level
+        # The GADDAG to generate moves from, if any
+        self._gaddag = Wordbase.gaddag() if robot_level in AutoPlayer.GADDAG_LEVELS else None
 
         # Calculate a bit pattern representation of the rack
         if u'?' in self._rack:
@@ -603,11 +968,17 @@ class AutoPlayer:
         else:
             # No wildcard: limits the possibilities of covering squares
             self._rack_bit_pattern = Alphabet.bit_pattern(self._rack)
+        # The rack as a list of tile counts, indexed by tile code
+        self._rack_counts = state.player_rack().counts()
 
     def board(self):
         """ Return the board """
         return self._board
 
+    def crosschecks(self):
+        """ Return the cross-checks and anchors of the board """
+        return self._crosschecks
+
     def rack(self):
         """ Return the rack, as a string of tiles """
         return self._rack
@@ -616,13 +987,35 @@ class AutoPlayer:
         """ Return the bit pattern corresponding to the rack """
         return self._rack_bit_pattern
 
+    def gaddag(self):
+        """ Return the GADDAG used for move generation, or None if using the DAWG """
+        return self._gaddag
+
+    def tile_scores(self):
+        """ Return the tile scores of the game's tile set, as a dict """
+        return self._scores
+
+    def rack_counts(self):
+        """ Return the rack, as a list of tile counts indexed by tile code """
+        return self._rack_counts
+
     def candidates(self):
-        """ The list of valid, candidate moves """
-        return self._candidates
+        """ The list of valid, candidate moves, as Move objects """
+        return [self._materialize(c) for c in self._candidates]
+
+    def add_candidate(self, candidate):
+        """ Add a candidate move record to the AutoPlayer's list or selector """
+        if self._selector is None:
+            self._candidates.append(candidate)
+        else:
+            self._selector.add(candidate)
 
-    def add_candidate(self, move):
-        """ Add a candidate move to the AutoPlayer's list """
-        self._candidates.append(move)
+    def _materialize(self, candidate):
+        """ Create a Move object from a candidate record """
+        row, col, horizontal, word, tiles = candidate[0:5]
+        move = Move(word, row, col, horizontal)
+        move.make_covers(self._board, tiles)
+        return move
 
     def _axis_from_row(self, row):
         """ Create and initialize an Axis from a board row """
@@ -637,29 +1030,38 @@ class AutoPlayer:
         return self._generate_move(depth = 1)
 
     def generate_best_moves(self, max_number = 0):
-        """ Returns a list in descending order of the n best moves, or all moves if n <= 0 """
-        self._generate_candidates()
-        if len(self._candidates) == 0:
-            # No candidates: no best move
-            return []
-        sorted_candidates = self._score_candidates()
-        if max_number <= 0:
-            # Return entire list if max_number <= 0
-            return sorted_candidates
-        # Return the top candidates
-        return sorted_candidates[0 : max_number]
-
-    def _generate_candidates(self):
-        """ Generate a fresh candidate list """
+        """ Returns a list in descending order of the n best moves, or all moves if n <= 0,
+            as (move, score) tuples """
+        selector = CandidateSelector(max_number if max_number > 0 else None, self._board.is_empty())
+        self._generate_candidates(selector)
+        sorted_candidates = selector.selected()
+        if max_number > 0:
+            # Only the top candidates are wanted, not any surplus ties
+            sorted_candidates = sorted_candidates[0 : max_number]
+        return [(self._materialize(c), sc) for c, sc in sorted_candidates]
+
+    def _left_parts(self):
+        """ Generate all possible permutations of the rack that form
+            left parts of words, ordered by length, or return None if
+            they are not needed """
+        # Left parts are not needed when generating moves from a GADDAG
+        if len(self._rack) > 1 and self._gaddag is None:
+            return LeftPartCache.lookup(Wordbase.dawg(), self._rack)
+        return None
+
+    def _generate_axis(self, index, horizontal, lpn):
+        """ Generate the candidate moves within a single row or column,
+            appending them to the candidate list """
+        axis = Axis(self, index, horizontal)
+        axis.init_crosschecks()
+        axis.generate_moves(lpn)
+
+    def _generate_candidates(self, selector = None):
+        """ Generate a fresh candidate list, or feed the candidates
+            to a CandidateSelector if one is given """
 
         self._candidates = []
-        # Start by generating all possible permutations of the
-        # rack that form left parts of words, ordering them by length
-        if len(self._rack) > 1:
-            lpn = LeftPermutationNavigator(self._rack)
-            Wordbase.dawg().navigate(lpn)
-        else:
-            lpn = None
+        self._selector = selector
 
         # Generate moves in one-dimensional space by looking at each axis
         # (row or column) on the board separately
@@ -673,24 +1075,31 @@ class AutoPlayer:
             axis.init_crosschecks()
             # Mark the center anchor
             axis.mark_anchor(Board.SIZE // 2)
-            axis.generate_moves(lpn)
-        else:
-            # Normal move: go through all 15 (row) + 15 (column) axes and generate
-            # valid moves within each of them
-            for r in range(Board.SIZE):
-                axis = self._axis_from_row(r)
-                axis.init_crosschecks()
-                axis.generate_moves(lpn)
-            for c in range(Board.SIZE):
-                axis = self._axis_from_column(c)
-                axis.init_crosschecks()
-                axis.generate_moves(lpn)
+            axis.generate_moves(self._left_parts())
+            return
+
+        # Normal move: go through all 15 (row) + 15 (column) axes and generate
+        # valid moves within each of them
+        axes = [(r, True) for r in range(Board.SIZE)] + [(c, False) for c in range(Board.SIZE)]
+        pool = AxisPool.get()
+        if pool is not None:
+            result = AxisPool.generate(pool, self._state, self._robot_level, axes, selector)
+            if result is not None:
+                candidates, count, first = result
+                if selector is None:
+                    self._candidates = candidates
+                else:
+                    selector.merge(candidates, count, first)
+                return
+        lpn = self._left_parts()
+        for index, horizontal in axes:
+            self._generate_axis(index, horizontal, lpn)
 
     def _generate_move(self, depth):
         """ Finds and returns a Move object to be played, eventually weighted by countermoves """
 
-        # Generate a fresh list of candidate moves
-        self._generate_candidates()
+        # Generate candidate moves, keeping the ones to pick from
+        self._generate_candidates(self._make_selector())
 
         # Pick the best move from the candidate list
         move = self._find_best_move(depth)
@@ -704,39 +1113,13 @@ class AutoPlayer:
         # If we can't exchange tiles, we have to pass
         return PassMove()
 
-    def _score_candidates(self):
-        """ Calculate the score of each candidate """
-
-        scored_candidates = [(m, self._state.score(m)) for m in self._candidates]
-
-        def keyfunc(x):
-            """ Sort moves first by descending score;
-                in case of ties prefer shorter words """
-            # !!! TODO: Insert more sophisticated logic here,
-            # including whether triple-word-score opportunities
-            # are being opened for the opponent, minimal use
-            # of blank tiles, leaving a good vowel/consonant
-            # balance on the rack, etc.
-            return (- x[1], x[0].num_covers())
-
-        def keyfunc_firstmove(x):
-            """ Special case for first move:
-                Sort moves first by descending score, and in case of ties,
-                try to go to the upper half of the board for a more open game
-            """
-            return (- x[1], x[0]._row)
-
-        # Sort the candidate moves using the appropriate key function
-        if self._board.is_empty():
-            # First move
-            scored_candidates.sort(key=keyfunc_firstmove)
-        else:
-            # Subsequent moves
-            scored_candidates.sort(key=keyfunc)
-        return scored_candidates
+    def _make_selector(self):
+        """ Return a CandidateSelector for the candidates that
+            _pick_candidate() chooses from """
+        return CandidateSelector(max(self._robot_level, 1), self._board.is_empty())
 
     def _pick_candidate(self, scored_candidates):
-        """ From a sorted list of >1 scored candidates, pick a move to make """
+        """ From a sorted list of >1 scored candidates, pick a candidate to play """
 
         num_candidates = len(scored_candidates)
         picklist = self._robot_level
@@ -759,15 +1142,165 @@ class AutoPlayer:
     def _find_best_move(self, depth):
         """ Analyze the list of candidate moves and pick the highest-scoring one """
 
-        if not self._candidates:
+        selector = self._selector
+        if not selector.count():
             # No moves: must exchange or pass instead
             return None
 
-        if len(self._candidates) == 1:
+        if selector.count() == 1:
             # Only one legal move: play it without further complication
-            return self._candidates[0]
+            return self._materialize(selector.first())
+
+        candidate = self._pick_candidate(selector.selected())
+        return None if candidate is None else self._materialize(candidate)
+
+
+def _generate_axes(task):
+    """ Generate the candidate moves within a list of axes, in a worker
+        process of the AxisPool, feeding them to a CandidateSelector with
+        the given parameters. Returns the number of candidates generated
+        after each axis, the first candidate generated, and the selected
+        candidates in generation order, as (sequence number, candidate) tuples. """
+    state, robot_level, (size, first_move, filtered), axes = task
+    apl = AutoPlayer.create(state, robot_level)
+    # Only AutoPlayer_Common filters candidates
+    apl._selector = CandidateSelector(size, first_move,
+        accept = apl._is_playable if filtered else None)
+    lpn = apl._left_parts()
+    counts = []
+    for index, horizontal in axes:
+        apl._generate_axis(index, horizontal, lpn)
+        counts.append(apl._selector.count())
+    return counts, apl._selector.first(), apl._selector.offered()
+
+
+class AxisPool:
+
+    """ An optional pool of worker processes that generate candidate moves
+        for the axes of the board in parallel. Each worker process has its
+        own copy of the game state, while the DAWG is shared through the
+        OS page cache when it is memory-mapped (and through copy-on-write
+        pages when workers are forked from a process that has already
+        loaded it). Each worker selects the top candidates of its axes with
+        a CandidateSelector equivalent to the caller's, so that only those
+        are returned to the caller. They are merged in the order of serial
+        generation, so the result is identical to serial generation.
+
+        Worker processes also keep their own copies of the dictionaries,
+        so the pool is retired when the dictionaries are reloaded.
+
+        The pool is not used unless WORKERS is set to a number larger than 1,
+        and move generation falls back to serial mode if worker processes
+        cannot be created, e.g. in the App Engine sandbox.
+    """
 
-        return self._pick_candidate(self._score_candidates())
+    # Number of worker processes; 0 or 1 means serial move generation
+    WORKERS = 0
+
+    _lock = threading.Lock()
+    _pool = None
+    _workers = 0
+    # Set if a pool could not be created; retried only if WORKERS changes
+    _failed_workers = None
+
+    @classmethod
+    def configure(cls, workers):
+        """ Set the number of worker processes, shutting down any existing pool """
+        cls.shutdown()
+        cls.WORKERS = workers
+
+    @classmethod
+    def get(cls):
+        """ Return the pool of worker processes, creating it if required,
+            or None if move generation should be serial """
+        workers = cls.WORKERS
+        if workers <= 1:
+            return None
+        with cls._lock:
+            if cls._pool is not None and cls._workers == workers:
+                return cls._pool
+            if cls._failed_workers == workers:
+                return None
+            try:
+                import multiprocessing
+                pool = multiprocessing.Pool(processes = workers)
+            except Exception as e:
+                # No process pool available here: use serial generation
+                logging.warning(u"Unable to create a pool of {0} move generation workers: {1}"
+                    .format(workers, e))
+                cls._failed_workers = workers
+                return None
+            if cls._pool is not None:
+                cls._pool.terminate()
+            cls._pool = pool
+            cls._workers = workers
+            return pool
+
+    @classmethod
+    def generate(cls, pool, state, robot_level, axes, selector = None):
+        """ Generate the candidate moves of the given axes in parallel. If a
+            selector is given, only the candidates that an equivalent selector
+            keeps within each worker are returned. Returns a tuple of the
+            returned candidates, in axis order, the total number of candidates
+            generated and the first of them, or None if the pool failed. """
+        # Deal the axes out to the workers in turn, since the axes
+        # in the middle of the board tend to have the most moves
+        num_tasks = min(cls._workers, len(axes))
+        positions = [range(i, len(axes), num_tasks) for i in range(num_tasks)]
+        # Without a selector, the workers return all candidates
+        params = (None, False, False) if selector is None else selector.params()
+        tasks = [(state, robot_level, params, [axes[pos] for pos in p]) for p in positions]
+        try:
+            results = pool.map(_generate_axes, tasks)
+        except Exception as e:
+            logging.warning(u"Parallel move generation failed, reverting to serial: {0}".format(e))
+            return None
+        by_axis = [None] * len(axes)
+        total = 0
+        first = None
+        first_pos = len(axes)
+        for p, (counts, task_first, offered) in zip(positions, results):
+            if task_first is not None:
+                # Find the axis of the first candidate of the task
+                pos = next(pos for pos, count in zip(p, counts) if count)
+                if pos < first_pos:
+                    first, first_pos = task_first, pos
+            # Assign the candidates to axes by their sequence numbers
+            per_axis = [[] for _ in p]
+            k = 0
+            for seq, candidate in offered:
+                while counts[k] < seq:
+                    k += 1
+                per_axis[k].append(candidate)
+            for pos, candidates in zip(p, per_axis):
+                by_axis[pos] = candidates
+            total += counts[-1]
+        return [m for candidates in by_axis for m in candidates], total, first
+
+    @classmethod
+    def shutdown(cls):
+        """ Terminate the worker processes, if any """
+        with cls._lock:
+            if cls._pool is not None:
+                cls._pool.terminate()
+                cls._pool = None
+                cls._workers = 0
+
+    @classmethod
+    def retire(cls):
+        """ Let the worker processes finish any move generation in progress
+            and exit, so that a fresh pool, with fresh copies of the
+            dictionaries, is created for the next move generation """
+        with cls._lock:
+            if cls._pool is not None:
+                cls._pool.close()
+                cls._pool = None
+                cls._workers = 0
+
+
+atexit.register(AxisPool.shutdown)
+Wordbase.add_reload_listener(AxisPool.retire)
+Wordbase.add_reload_listener(LeftPartCache.clear)
 
 
 class AutoPlayer_Common(AutoPlayer):
@@ -779,29 +1312,35 @@ class AutoPlayer_Common(AutoPlayer):
     def __init__(self, state, robot_level):
         AutoPlayer.__init__(self, state, robot_level)
         self._play_one_of = 20 # Plays one of the 20 top candidates
+        self._common = Wordbase.dawg_common() # List of playable common words
+
+    def _is_playable(self, candidate):
+        """ Is the principal word of the candidate playable at this level? """
+        w = candidate[3]
+        return len(w) == 2 or w in self._common
+
+    def _make_selector(self):
+        """ Select the top playable candidates """
+        return CandidateSelector(self._play_one_of, self._board.is_empty(),
+            accept = self._is_playable)
 
     def _pick_candidate(self, scored_candidates):
-        """ From a sorted list of >1 scored candidates, pick a move to make """
+        """ From a sorted list of >1 scored candidates, pick a candidate to play """
 
         num_candidates = len(scored_candidates)
-        common = Wordbase.dawg_common() # List of playable common words
         playable_candidates = []
-        # Iterate through the candidates in descending score order
-        # until we have enough playable ones or we have exhausted the list
+        # Iterate through the candidates, which are all playable, in descending
+        # score order until we have enough of them or we have exhausted the list
         i = 0 # Candidate index
         p = 0 # Playable index
         while p < self._play_one_of and i < num_candidates:
-            m = scored_candidates[i][0] # Candidate move
-            w = m.word() # The principal word being played
-            if len(w) == 2 or w in common:
-                # This one is playable - but we still won't put it on
-                # the candidate list if has the same score as the
-                # first (top-scoring) playable word
-                if p == 1 and scored_candidates[i][1] == playable_candidates[0][1]:
-                    pass
-                else:
-                    playable_candidates.append(scored_candidates[i])
-                    p += 1
+            # We won't put this one on the candidate list if it has
+            # the same score as the first (top-scoring) playable word
+            if p == 1 and scored_candidates[i][1] == playable_candidates[0][1]:
+                pass
+            else:
+                playable_candidates.append(scored_candidates[i])
+                p += 1
             i += 1
         # Now we have a list of up to self._play_one_of playable moves
         if p == 0:
@@ -817,56 +1356,42 @@ class AutoPlayer_MiniMax(AutoPlayer):
         select a move to play from the list of valid moves.
     """
 
+    NUM_CANDIDATES = 12 # How many top candidates do we look at with MiniMax?
+
+    # A fast random number generator for drawing the simulated racks
+    RNG = Random()
+
     def __init__(self, state):
         AutoPlayer.__init__(self, state)
 
+    def _make_selector(self):
+        """ Select the top candidates to look at """
+        return CandidateSelector(AutoPlayer_MiniMax.NUM_CANDIDATES, self._board.is_empty())
+
     def _find_best_move(self, depth):
         """ Analyze the list of candidate moves and pick the best one """
 
         # assert depth >= 0
 
-        if not self._candidates:
+        selector = self._selector
+        if not selector.count():
             # No moves: must exchange or pass instead
             return None
 
-        if len(self._candidates) == 1:
+        if selector.count() == 1:
             # Only one legal move: play it
-            return self._candidates[0]
+            return self._materialize(selector.first())
 
         # !!! TODO: Consider looking at exchange moves if there are
         # few and weak candidates
 
-        # Calculate the score of each candidate
-        scored_candidates = [(m, self._state.score(m)) for m in self._candidates]
-
-        def keyfunc(x):
-            # Sort moves first by descending score;
-            # in case of ties prefer shorter words
-            # !!! TODO: Insert more sophisticated logic here,
-            # including whether triple-word-score opportunities
-            # are being opened for the opponent, minimal use
-            # of blank tiles, leaving a good vowel/consonant
-            # balance on the rack, etc.
-            return (- x[1], x[0].num_covers())
-
-        def keyfunc_firstmove(x):
-            # Special case for first move:
-            # Sort moves first by descending score, and in case of ties,
-            # try to go to the upper half of the board for a more open game
-            return (- x[1], x[0]._row)
-
-        # Sort the candidate moves using the appropriate key function
-        if self._board.is_empty():
-            # First move
-            scored_candidates.sort(key=keyfunc_firstmove)
-        else:
-            # Subsequent moves
-            scored_candidates.sort(key=keyfunc)
+        # Fetch the top scoring candidates, sorted
+        scored_candidates = selector.selected()
 
         # If we're not going deeper into the minimax analysis,
         # cut the crap and simply return the top scoring move
         if depth == 0:
-            return scored_candidates[0][0]
+            return self._materialize(scored_candidates[0][0])
 
         # Weigh top candidates by alpha-beta testing of potential
         # moves and counter-moves
@@ -875,56 +1400,62 @@ class AutoPlayer_MiniMax(AutoPlayer):
         # we need not consider opponent countermoves
 
         NUM_TEST_RACKS = 20 # How many random test racks to try for statistical average
-        NUM_CANDIDATES = 12 # How many top candidates do we look at with MiniMax?
 
         weighted_candidates = []
         min_score = None
 
-        print(u"Looking at {0} top scoring candidate moves".format(NUM_CANDIDATES))
+        print(u"Looking at {0} top scoring candidate moves".format(AutoPlayer_MiniMax.NUM_CANDIDATES))
         # Look at the top scoring candidates
-        for m, score in scored_candidates[0:NUM_CANDIDATES]:
+        for c, score in scored_candidates[0:AutoPlayer_MiniMax.NUM_CANDIDATES]:
+
+            m = self._materialize(c)
 
             print(u"Candidate move {0} with raw score {1}".format(m, score))
 
-            # Create a game state where the candidate move has been played
-            teststate = State(tileset = None, copy = self._state) # Copy constructor
-            teststate.apply_move(m)
+            # Play the candidate move on the game state, drawing with the fast
+            # random number generator, and revert it after the countermoves
+            teststate = self._state
+            undo = teststate.make_move(m, rng = AutoPlayer_MiniMax.RNG)
 
             countermoves = list()
 
-            if teststate.is_game_over():
-                # This move finishes the game. The opponent then scores nothing
-                # !!! TODO: (and in fact we get her tile score, but leave that aside here)
-                avg_score = 0.0
-                countermoves.append(0)
-            else:
-                # Loop over NUM_TEST_RACKS random racks to find the average countermove score
-                sum_score = 0
-                rackscores = dict()
-                for _ in range(NUM_TEST_RACKS):
-                    # Make sure we test this for a random opponent rack
-                    teststate.randomize_and_sort_rack()
-                    rack = teststate.player_rack().contents()
-                    if rack in rackscores:
-                        # We have seen this rack before: fetch its score
-                        sc = rackscores[rack]
-                    else:
-                        # New rack: see how well it would score
-                        apl = AutoPlayer_MiniMax(teststate)
-                        # Go one level deeper into move generation
-                        move = apl._generate_move(depth = depth - 1)
-                        # Calculate the score of this random rack based move
-                        # but do not apply it to the teststate
-                        sc = teststate.score(move)
-                        if sc > 100:
-                            print(u"Countermove rack '{0}' generated move {1} scoring {2}".format(rack, move, sc))
-                        # Cache the score
-                        rackscores[rack] = sc
-                    sum_score += sc
-                    countermoves.append(sc)
-                # Calculate the average score of the countermoves to this candidate
-                # !!! TODO: Maybe a median score is better than average?
-                avg_score = float(sum_score) / NUM_TEST_RACKS
+            try:
+                if teststate.is_game_over():
+                    # This move finishes the game. The opponent then scores nothing
+                    # !!! TODO: (and in fact we get her tile score, but leave that aside here)
+                    avg_score = 0.0
+                    countermoves.append(0)
+                else:
+                    # Loop over NUM_TEST_RACKS random racks to find the average countermove score
+                    sum_score = 0
+                    rackscores = dict()
+                    for _ in range(NUM_TEST_RACKS):
+                        # Make sure we test this for a random opponent rack
+                        teststate.randomize_and_sort_rack()
+                        rack = teststate.player_rack().contents()
+                        if rack in rackscores:
+                            # We have seen this rack before: fetch its score
+                            sc = rackscores[rack]
+                        else:
+                            # New rack: see how well it would score
+                            apl = AutoPlayer_MiniMax(teststate)
+                            # Go one level deeper into move generation
+                            move = apl._generate_move(depth = depth - 1)
+                            # Calculate the score of this random rack based move
+                            # but do not apply it to the teststate
+                            sc = teststate.score(move)
+                            if sc > 100:
+                                print(u"Countermove rack '{0}' generated move {1} scoring {2}".format(rack, move, sc))
+                            # Cache the score
+                            rackscores[rack] = sc
+                        sum_score += sc
+                        countermoves.append(sc)
+                    # Calculate the average score of the countermoves to this candidate
+                    # !!! TODO: Maybe a median score is better than average?
+                    avg_score = float(sum_score) / NUM_TEST_RACKS
+            finally:
+                # Revert the candidate move even if countermove generation fails
+                teststate.unmake_move(undo)
 
             print(u"Average score of {0} countermove racks is {1:.2f}".format(NUM_TEST_RACKS, avg_score))
             print(countermoves)
@@ -941,7 +1472,7 @@ class AutoPlayer_MiniMax(AutoPlayer):
         weighted_candidates.sort(key = lambda x: float(x[1]) - (x[2] - min_score), reverse = True)
 
         print(u"AutoPlayer_MinMax: Rack '{0}' generated {1} candidate moves:"
-            .format(self._rack, len(scored_candidates)))
+            .format(self._rack, selector.count()))
         # Show top 20 candidates
         for m, sc, wsc in weighted_candidates:
             print(u"Move {0} score {1} weighted {2:.2f}".format(m, sc, float(sc) - (wsc - min_score)))
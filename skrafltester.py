@@ -12,6 +12,10 @@
         [-n number_of_games_to_run (default 4)]
         [-o minimax|autoplayer (to choose opponent, default minimax)]
         [-s (to run silently, i.e. only with ending summary)]
+        [-b (to benchmark GADDAG against DAWG move generation)]
+        [-k (to benchmark move generation with zero, one and two blank tiles in the rack)]
+        [-w number_of_worker_processes (for parallel move generation, default 0)]
+        [-r random_seed (to make the tile draws and robot choices reproducible)]
 
 """
 
@@ -20,14 +24,20 @@ from __future__ import print_function
 import getopt
 import sys
 import time
+import random
 
 from languages import NewTileSet
 from skraflmechanics import State, Board, Move, ExchangeMove, ChallengeMove, ResponseMove, Error
-from skraflplayer import AutoPlayer, AutoPlayer_MiniMax
+from skraflplayer import AutoPlayer, AutoPlayer_MiniMax, AxisPool
+from dawgdictionary import Wordbase
 
 
 _PROFILING = False
 
+# The test games draw their tiles using a fast pseudo-random number generator
+# instead of the cryptographic one used for live games
+_RNG = random.Random()
+
 
 def test_move(state, movestring):
     """ Test placing a simple tile move """
@@ -125,7 +135,7 @@ def test_game(players, silent):
     # on behalf of the player.
 
     # Initial, empty game state
-    state = State(tileset = NewTileSet, drawtiles = True)
+    state = State(tileset = NewTileSet, drawtiles = True, rng = _RNG)
 
     print(u"After initial draw, bag contains {0} tiles".format(state.bag().num_tiles()))
     print(u"Bag contents are:\n{0}".format(state.bag().contents()))
@@ -183,7 +193,7 @@ def test_manual_game():
     """ Manual game test """
 
     # Initial, empty game state
-    state = State(tileset = NewTileSet, manual_wordcheck = True, drawtiles = True)
+    state = State(tileset = NewTileSet, manual_wordcheck = True, drawtiles = True, rng = _RNG)
 
     print(u"Manual game")
     print(u"After initial draw, bag contains {0} tiles".format(state.bag().num_tiles()))
@@ -227,6 +237,89 @@ def test_manual_game():
         state.num_moves(), state.player_name(0), state.player_name(1)))
 
 
+def benchmark_movegen(num_games):
+    """ Compare move generation using the DAWG and the GADDAG on the same positions """
+
+    if Wordbase.gaddag() is None:
+        print(u"No GADDAG found: run dawgbuilder.py -g to build resources/ordalisti.bin.gaddag")
+        return
+
+    def generate(state, levels):
+        """ Generate candidate moves for the state, timing the generation """
+        AutoPlayer.GADDAG_LEVELS = levels
+        apl = AutoPlayer(state)
+        g0 = time.time()
+        apl._generate_candidates()
+        g1 = time.time()
+        return sorted(move.summary(state) for move in apl.candidates()), g1 - g0
+
+    # Make sure that the DAWG has been loaded before timing anything
+    Wordbase.dawg()
+    saved_levels = AutoPlayer.GADDAG_LEVELS
+    positions = 0
+    mismatches = 0
+    time_dawg = 0.0
+    time_gaddag = 0.0
+    try:
+        for _ in range(num_games):
+            state = State(tileset = NewTileSet, drawtiles = True, rng = _RNG)
+            while not state.is_game_over():
+                cand_dawg, t_dawg = generate(state, frozenset())
+                cand_gaddag, t_gaddag = generate(state, frozenset([0]))
+                positions += 1
+                time_dawg += t_dawg
+                time_gaddag += t_gaddag
+                if cand_dawg != cand_gaddag:
+                    mismatches += 1
+                    print(u"Mismatch in candidate moves at position {0}".format(positions))
+                AutoPlayer.GADDAG_LEVELS = frozenset()
+                state.apply_move(AutoPlayer(state).generate_move())
+    finally:
+        AutoPlayer.GADDAG_LEVELS = saved_levels
+
+    print(u"Benchmark completed, {0} positions in {1} games, {2} mismatches"
+        .format(positions, num_games, mismatches))
+    print(u"DAWG move generation took {0:.2f} seconds, GADDAG {1:.2f} seconds"
+        .format(time_dawg, time_gaddag))
+
+
+def benchmark_blanks(num_games):
+    """ Time move generation on the same positions with zero, one and two
+        blank tiles in the rack, replacing other tiles with the blanks """
+
+    # Make sure that the DAWG has been loaded before timing anything
+    Wordbase.dawg()
+    positions = 0
+    time_total = [0.0] * 3
+    time_worst = [0.0] * 3
+    num_candidates = [0] * 3
+    for _ in range(num_games):
+        state = State(tileset = NewTileSet, drawtiles = True, rng = _RNG)
+        while not state.is_game_over():
+            player = state.player_to_move()
+            # The rack without any blank tiles it may already have
+            tiles = state.player_rack().contents().replace(u'?', u'')
+            positions += 1
+            for blanks in range(3):
+                test_state = State(tileset = None, copy = state)
+                test_state.set_rack(player, u'?' * blanks + tiles[blanks:])
+                apl = AutoPlayer(test_state)
+                g0 = time.time()
+                apl._generate_candidates()
+                t = time.time() - g0
+                time_total[blanks] += t
+                time_worst[blanks] = max(time_worst[blanks], t)
+                num_candidates[blanks] += len(apl.candidates())
+            state.apply_move(AutoPlayer(state).generate_move())
+
+    print(u"Benchmark completed, {0} positions in {1} games".format(positions, num_games))
+    for blanks in range(3):
+        print(u"{0} blank tile(s): {1} candidates, {2:.2f} seconds in total, "
+            u"{3:.3f} on average and {4:.3f} at worst per position"
+            .format(blanks, num_candidates[blanks], time_total[blanks],
+                time_total[blanks] / positions if positions else 0.0, time_worst[blanks]))
+
+
 def test(num_games, opponent, silent):
 
     def autoplayer_creator(state):
@@ -310,13 +403,17 @@ def main(argv=None):
         argv = sys.argv
     try:
         try:
-            opts, _ = getopt.getopt(argv[1:], "hn:o:sm", ["help", "numgames", "opponent", "silent", "manual"])
+            opts, _ = getopt.getopt(argv[1:], "hn:o:smbkw:r:",
+                ["help", "numgames", "opponent", "silent", "manual", "benchmark", "blanks", "workers=",
+                "seed="])
         except getopt.error as msg:
              raise Usage(msg)
         num_games = 4
         opponent = "autoplayer"
         silent = False
         manual = False
+        benchmark = False
+        blanks = False
         # process options
         for o, a in opts:
             if o in ("-h", "--help"):
@@ -330,11 +427,30 @@ def main(argv=None):
                 silent = True
             elif o in ("-m", "--manual"):
                 manual = True
+            elif o in ("-b", "--benchmark"):
+                benchmark = True
+            elif o in ("-k", "--blanks"):
+                blanks = True
+            elif o in ("-w", "--workers"):
+                AxisPool.configure(int(a))
+            elif o in ("-r", "--seed"):
+                # Seed the tile draws, the simulated racks of the MiniMax
+                # player and the robots' choices between candidate moves
+                seed = int(a)
+                _RNG.seed(seed)
+                AutoPlayer_MiniMax.RNG.seed(seed)
+                random.seed(seed)
 
         print(u"Welcome to the Skrafl game tester")
 
         if manual:
             test_manual_game()
+        elif benchmark:
+            print(u"Benchmarking move generation in {0} games".format(num_games))
+            benchmark_movegen(num_games)
+        elif blanks:
+            print(u"Benchmarking move generation with blank tiles in {0} games".format(num_games))
+            benchmark_blanks(num_games)
         else:
             print(u"Running {0} games against {1}".format(num_games, opponent or u"autoplayer"))
             test(num_games, opponent, silent)